@@ -0,0 +1,142 @@
+'Odyssey Web server side document model. Text format is the same as client side serialization (see static/odyssey_test.py)'
+
+import re
+from enum import Enum, auto
+
+# object & document ID: URL safe base64 alphabet # IDs are used in file names & rendered markup unescaped
+ID_RE = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+class Layers(Enum):
+	Electric = auto()
+	Stamp = auto()
+	Draw = auto()
+	Notes = auto()
+
+
+class Multiline:
+
+	DEFAULT_WIDTH = 2
+
+	__slots__ = ('id', 'layer', 'closed', 'width', 'points')
+
+	def __init__(self, id: str, layer: Layers, closed: bool, points, width=DEFAULT_WIDTH):
+		self.id, self.layer = id, layer
+		self.closed, self.width = closed, width
+		self.points: tuple[tuple[int, int], ...] = tuple(points)
+
+	def __eq__(self, other) -> bool:
+		return isinstance(other, Multiline) and self.id == other.id and self.layer == other.layer\
+			and self.closed == other.closed and self.width == other.width and self.points == other.points
+
+	def serialize(self, offset=0) -> str:
+		offset = '\t' * offset
+		ret = [f'{offset}multiline:\n']
+		offset += '\t'
+		ret.append(f'{offset}id:{self.id}\n')
+		ret.append(f'{offset}layer:{self.layer.name}\n')
+		if self.closed:
+			ret.append(f'{offset}closed:1\n')
+		if self.width != self.DEFAULT_WIDTH:
+			ret.append(f'{offset}width:{self.width}\n')
+		for x, y in self.points:
+			ret.append(f'{offset}- {x},{y}\n')
+		return ''.join(ret)
+
+	def snapshot(self) -> list:
+		'Returns compact JSON compatible state: [id, layer, closed, width, [x0, y0, x1, y1, ...]]'
+		return [self.id, self.layer.name, int(self.closed), self.width, [c for p in self.points for c in p]]
+
+	@classmethod
+	def from_snapshot(cls, snapshot: list) -> 'Multiline':
+		id, layer, closed, width, points = snapshot
+		return cls(id, Layers[layer], bool(closed), zip(points[::2], points[1::2]), width)
+
+
+class Document:
+	'Document objects ordered by ID'
+
+	# approximate memory used by document object & point # used by cache memory budget
+	ITEM_SIZE = 400
+	POINT_SIZE = 120
+
+	def __init__(self, items=()):
+		self.items: dict[str, Multiline] = {x.id: x for x in items}
+
+	def __len__(self) -> int:
+		return len(self.items)
+
+	def __iter__(self):
+		return iter(self.items.values())
+
+	def get_size(self) -> int:
+		'Returns approximate memory size, bytes'
+		return sum(self.ITEM_SIZE + self.POINT_SIZE * len(x.points) for x in self.items.values())
+
+	def serialize(self) -> str:
+		return ''.join('- ' + x.serialize() for x in self.items.values())
+
+	def snapshot(self) -> list:
+		'Returns compact JSON compatible state: [[id, layer, closed, width, [x0, y0, x1, y1, ...]], ...]'
+		return [x.snapshot() for x in self.items.values()]
+
+	def diff(self, base: 'Document') -> list:
+		'''Returns operations to change base document to this document:
+		['add', object snapshot], ['replace', object snapshot], ['delete', id]'''
+		ret = [['delete', k] for k in base.items if k not in self.items]
+		for k, v in self.items.items():
+			if not (old := base.items.get(k)):
+				ret.append(['add', v.snapshot()])
+			elif old != v:
+				ret.append(['replace', v.snapshot()])
+		return ret
+
+	def apply(self, ops: list):
+		'''Applies operations of diff & ['clear'] operation (remove all objects).
+		Operations set state, so replay of already applied operations does not change document'''
+		for op in ops:
+			match op[0]:
+				case 'add' | 'replace':
+					item = Multiline.from_snapshot(op[1])
+					self.items[item.id] = item
+				case 'delete':
+					self.items.pop(op[1], None)
+				case 'clear':
+					self.items.clear()
+				case _:
+					raise ValueError(f'Unknown operation: {op[0]!r}')
+
+	@classmethod
+	def parse(cls, text: str) -> 'Document':
+		'Returns document parsed from text. Raises ValueError for malformed text'
+		items, item = [], None
+		for n, line in enumerate(text.splitlines(), 1):
+			if not (line := line.strip()):
+				continue
+			try:
+				if line == '- multiline:':
+					item = {'id': None, 'layer': Layers.Draw, 'closed': False, 'width': Multiline.DEFAULT_WIDTH, 'points': []}
+					items.append(item)
+				elif not item:
+					raise ValueError('object expected')
+				elif line.startswith('- '):
+					x, y = line[2:].split(',')
+					item['points'].append((int(x), int(y)))
+				else:
+					k, v = line.split(':', 1)
+					match k:
+						case 'id':
+							if not ID_RE.fullmatch(v):
+								raise ValueError('invalid object id')
+							item['id'] = v
+						case 'layer':
+							item['layer'] = Layers[v]
+						case 'closed':
+							item['closed'] = v == '1'
+						case 'width':
+							item['width'] = int(v)
+			except (KeyError, ValueError) as e:
+				raise ValueError(f'Document line {n}: {line!r}: {e}') from None
+		for item in items:
+			if not item['id']:
+				raise ValueError('Document object without id')
+		return cls(Multiline(**x) for x in items)
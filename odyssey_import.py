@@ -0,0 +1,357 @@
+'''Odyssey Web documents import from SVG & DXF files.
+File is scanned sequentially into chunks of raw elements (scan_* functions), chunks are converted to document text
+by converter functions (convert_* functions) that are run by worker processes pool.
+Scan functions read file path or binary file object & raise ValueError for malformed file'''
+
+import io
+import re
+from math import atan2, ceil, cos, pi, radians, sin, sqrt, tan
+from secrets import token_urlsafe
+from typing import BinaryIO
+from xml.etree.ElementTree import ParseError, iterparse
+# Odyssey Web imports
+from odyssey_document import Layers, Multiline
+
+
+CHUNK_SIZE = 1000  # elements count per chunk
+CURVE_STEPS = 8  # line segments per curve
+ELLIPSE_STEPS = 32  # line segments per ellipse
+DEFAULT_LAYER = Layers.Draw
+
+IDENTITY = (1., 0., 0., 1., 0., 0.)  # SVG matrix (a, b, c, d, e, f)
+
+SVG_NS = '{http://www.w3.org/2000/svg}'
+INKSCAPE_LABEL = '{http://www.inkscape.org/namespaces/inkscape}label'
+SVG_SHAPES = {'path', 'polyline', 'polygon', 'line', 'rect', 'circle', 'ellipse'}
+# containers of not rendered elements: shapes inside are not imported
+SVG_HIDDEN = {'defs', 'clipPath', 'mask', 'marker', 'symbol', 'pattern'}
+SVG_SHAPE_ATTRS = ('d', 'points', 'x', 'y', 'x1', 'y1', 'x2', 'y2', 'width', 'height', 'cx', 'cy', 'r', 'rx', 'ry')
+
+NUMBER_RE = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+PATH_RE = re.compile(r'[MmLlHhVvCcSsQqTtAaZz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+TRANSFORM_RE = re.compile(r'(matrix|translate|scale|rotate|skewX|skewY)\s*\(([^)]*)\)')
+# path command: arguments count
+PATH_ARGS = {'M': 2, 'L': 2, 'H': 1, 'V': 1, 'C': 6, 'S': 4, 'Q': 4, 'T': 2, 'A': 7, 'Z': 0}
+
+
+def new_id() -> str:
+	return 'i' + token_urlsafe(6)
+
+def get_layer(name: str | None) -> Layers | None:
+	'Returns document layer by name (case insensitive)'
+	if name:
+		name = name.strip().lower()
+		for layer in Layers:
+			if layer.name.lower() == name:
+				return layer
+	return None
+
+def serialize_lines(lines) -> str:
+	'Returns document text of (layer, closed, points) lines'
+	ret = []
+	for layer, closed, points in lines:
+		# remove duplicate points after rounding
+		points = [p for i, p in enumerate(points) if not i or p != points[i - 1]]
+		if closed and len(points) > 1 and points[-1] == points[0]:
+			points.pop()
+		if len(points) > 1:
+			ret.append('- ' + Multiline(new_id(), layer, closed, points).serialize())
+	return ''.join(ret)
+
+
+# SVG
+
+def multiply(m1: tuple, m2: tuple) -> tuple:
+	'Returns matrix m1 * m2'
+	a1, b1, c1, d1, e1, f1 = m1
+	a2, b2, c2, d2, e2, f2 = m2
+	return (a1 * a2 + c1 * b2, b1 * a2 + d1 * b2, a1 * c2 + c1 * d2, b1 * c2 + d1 * d2,
+		a1 * e2 + c1 * f2 + e1, b1 * e2 + d1 * f2 + f1)
+
+def parse_transform(text: str | None) -> tuple:
+	'Returns matrix of SVG transform attribute'
+	ret = IDENTITY
+	for name, args in TRANSFORM_RE.findall(text or ''):
+		v = [float(x) for x in NUMBER_RE.findall(args)]
+		match name, len(v):
+			case 'matrix', 6:
+				m = tuple(v)
+			case 'translate', 1 | 2:
+				m = (1., 0., 0., 1., v[0], v[1] if len(v) > 1 else 0.)
+			case 'scale', 1 | 2:
+				m = (v[0], 0., 0., v[1] if len(v) > 1 else v[0], 0., 0.)
+			case 'rotate', 1 | 3:
+				a = radians(v[0])
+				m = (cos(a), sin(a), -sin(a), cos(a), 0., 0.)
+				if len(v) == 3:
+					m = multiply(multiply((1., 0., 0., 1., v[1], v[2]), m), (1., 0., 0., 1., -v[1], -v[2]))
+			case 'skewX', 1:
+				m = (1., 0., tan(radians(v[0])), 1., 0., 0.)
+			case 'skewY', 1:
+				m = (1., tan(radians(v[0])), 0., 1., 0., 0.)
+			case _:
+				continue
+		ret = multiply(ret, m)
+	return ret
+
+def scan_svg(source: str | BinaryIO, chunk_size=CHUNK_SIZE):
+	'''Yields chunks of SVG shapes: [(tag, attrs, layer name, matrix), ...]
+	Layer is set by group inkscape:label or id attribute'''
+	try:
+		yield from _scan_svg(source, chunk_size)
+	except ParseError as e:
+		raise ValueError(f'Malformed SVG: {e}') from None
+
+def _scan_svg(source: str | BinaryIO, chunk_size: int):
+	chunk, stack = [], [(DEFAULT_LAYER.name, IDENTITY)]  # groups: (layer name, matrix)
+	elems = []  # open elements: root ... parent of current element
+	hidden = 0  # open not rendered containers count
+	for event, elem in iterparse(source, events=('start', 'end')):
+		tag = elem.tag.removeprefix(SVG_NS)
+		if event == 'start':
+			elems.append(elem)
+			if tag in SVG_HIDDEN:
+				hidden += 1
+			if tag == 'g' or tag == 'svg':
+				layer = get_layer(elem.get(INKSCAPE_LABEL)) or get_layer(elem.get('id'))
+				stack.append((layer.name if layer else stack[-1][0], multiply(stack[-1][1], parse_transform(elem.get('transform')))))
+			continue
+		if tag in SVG_HIDDEN:
+			hidden -= 1
+		elif tag == 'g' or tag == 'svg':
+			stack.pop()
+		elif tag in SVG_SHAPES and not hidden:
+			attrs = {k: v for k in SVG_SHAPE_ATTRS if (v := elem.get(k)) is not None}
+			layer, m = stack[-1]
+			if(t := elem.get('transform')):
+				m = multiply(m, parse_transform(t))
+			chunk.append((tag, attrs, layer, m))
+			if len(chunk) >= chunk_size:
+				yield chunk
+				chunk = []
+		# free parsed element # finished siblings are removed, so element is the first child of parent
+		elems.pop()
+		elem.clear()
+		if elems:
+			elems[-1].remove(elem)
+	if chunk:
+		yield chunk
+
+def arc_points(p1: tuple, rx: float, ry: float, angle: float, large: bool, sweep: bool, p2: tuple) -> list:
+	'Returns points of SVG elliptical arc from p1 to p2, p1 excluded (SVG implementation notes: F.6.5)'
+	if not rx or not ry:
+		return [p2]
+	rx, ry = abs(rx), abs(ry)
+	phi = radians(angle)
+	cos_phi, sin_phi = cos(phi), sin(phi)
+	dx, dy = (p1[0] - p2[0]) / 2, (p1[1] - p2[1]) / 2
+	x1, y1 = cos_phi * dx + sin_phi * dy, -sin_phi * dx + cos_phi * dy
+	# correct out-of-range radii
+	if(s := x1 * x1 / (rx * rx) + y1 * y1 / (ry * ry)) > 1:
+		rx, ry = rx * sqrt(s), ry * sqrt(s)
+	num = rx * rx * ry * ry - rx * rx * y1 * y1 - ry * ry * x1 * x1
+	k = sqrt(max(0., num) / (rx * rx * y1 * y1 + ry * ry * x1 * x1))
+	if large == sweep:
+		k = -k
+	cx1, cy1 = k * rx * y1 / ry, -k * ry * x1 / rx
+	cx = cos_phi * cx1 - sin_phi * cy1 + (p1[0] + p2[0]) / 2
+	cy = sin_phi * cx1 + cos_phi * cy1 + (p1[1] + p2[1]) / 2
+	a1 = atan2((y1 - cy1) / ry, (x1 - cx1) / rx)
+	da = atan2((-y1 - cy1) / ry, (-x1 - cx1) / rx) - a1
+	if sweep and da < 0:
+		da += 2 * pi
+	elif not sweep and da > 0:
+		da -= 2 * pi
+	steps = max(1, ceil(abs(da) / (pi / 2) * CURVE_STEPS / 2))
+	ret = []
+	for i in range(1, steps + 1):
+		a = a1 + da * i / steps
+		x, y = rx * cos(a), ry * sin(a)
+		ret.append((cos_phi * x - sin_phi * y + cx, sin_phi * x + cos_phi * y + cy))
+	ret[-1] = p2
+	return ret
+
+def parse_path(d: str) -> list:
+	'Returns subpaths of SVG path data: [(closed, points), ...]'
+	ret, points = [], []
+	pos = start = ctrl = (0., 0.)  # current point, subpath start, last control point
+	cmd, prev_cmd = None, None
+	tokens = PATH_RE.findall(d)
+	i = 0
+	while i < len(tokens):
+		if tokens[i].isalpha():
+			cmd = tokens[i]
+			i += 1
+		elif not cmd or not PATH_ARGS[cmd.upper()]:
+			break  # malformed path: no command or arguments of command without arguments (Z)
+		c = cmd.upper()
+		n = PATH_ARGS[c]
+		if i + n > len(tokens):
+			break
+		try:
+			v = [float(x) for x in tokens[i:i + n]]
+		except ValueError:
+			break  # command instead of argument
+		i += n
+		rel = cmd.islower()
+		ox, oy = pos if rel else (0., 0.)
+		match c:
+			case 'M':
+				if len(points) > 1:
+					ret.append((False, points))
+				pos = start = (v[0] + ox, v[1] + oy)
+				points = [pos]
+				cmd = 'l' if rel else 'L'  # implicit lineto
+			case 'L':
+				pos = (v[0] + ox, v[1] + oy)
+				points.append(pos)
+			case 'H':
+				pos = (v[0] + ox, pos[1])
+				points.append(pos)
+			case 'V':
+				pos = (pos[0], v[0] + (pos[1] if rel else 0.))
+				points.append(pos)
+			case 'C' | 'S' | 'Q' | 'T':
+				if c == 'C':
+					c1, c2, p = (v[0] + ox, v[1] + oy), (v[2] + ox, v[3] + oy), (v[4] + ox, v[5] + oy)
+				elif c == 'S':
+					c1 = (2 * pos[0] - ctrl[0], 2 * pos[1] - ctrl[1]) if prev_cmd in ('C', 'S') else pos
+					c2, p = (v[0] + ox, v[1] + oy), (v[2] + ox, v[3] + oy)
+				elif c == 'Q':
+					c1, p = (v[0] + ox, v[1] + oy), (v[2] + ox, v[3] + oy)
+				else:
+					c1 = (2 * pos[0] - ctrl[0], 2 * pos[1] - ctrl[1]) if prev_cmd in ('Q', 'T') else pos
+					p = (v[0] + ox, v[1] + oy)
+				p0 = pos
+				for j in range(1, CURVE_STEPS + 1):
+					t = j / CURVE_STEPS
+					u = 1 - t
+					if c in ('C', 'S'):
+						points.append((u * u * u * p0[0] + 3 * u * u * t * c1[0] + 3 * u * t * t * c2[0] + t * t * t * p[0],
+							u * u * u * p0[1] + 3 * u * u * t * c1[1] + 3 * u * t * t * c2[1] + t * t * t * p[1]))
+					else:
+						points.append((u * u * p0[0] + 2 * u * t * c1[0] + t * t * p[0], u * u * p0[1] + 2 * u * t * c1[1] + t * t * p[1]))
+				ctrl = c2 if c in ('C', 'S') else c1
+				pos = p
+			case 'A':
+				p = (v[5] + ox, v[6] + oy)
+				points.extend(arc_points(pos, v[0], v[1], v[2], bool(v[3]), bool(v[4]), p))
+				pos = p
+			case 'Z':
+				if len(points) > 1:
+					ret.append((True, points))
+				pos = start
+				points = [pos]
+		prev_cmd = c
+	if len(points) > 1:
+		ret.append((False, points))
+	return ret
+
+def svg_shape_lines(tag: str, attrs: dict) -> list:
+	'Returns lines of SVG shape: [(closed, points), ...]'
+	def get(k: str) -> float:
+		return float(attrs.get(k, 0) or 0)
+	match tag:
+		case 'path':
+			return parse_path(attrs.get('d', ''))
+		case 'polyline' | 'polygon':
+			v = [float(x) for x in NUMBER_RE.findall(attrs.get('points', ''))]
+			return [(tag == 'polygon', list(zip(v[0::2], v[1::2])))]
+		case 'line':
+			return [(False, [(get('x1'), get('y1')), (get('x2'), get('y2'))])]
+		case 'rect':
+			x, y, w, h = get('x'), get('y'), get('width'), get('height')
+			return [(True, [(x, y), (x + w, y), (x + w, y + h), (x, y + h)])] if w and h else []
+		case 'circle' | 'ellipse':
+			cx, cy = get('cx'), get('cy')
+			rx, ry = (get('r'), get('r')) if tag == 'circle' else (get('rx'), get('ry'))
+			if not rx or not ry:
+				return []
+			return [(True, [(cx + rx * cos(2 * pi * i / ELLIPSE_STEPS), cy + ry * sin(2 * pi * i / ELLIPSE_STEPS))
+				for i in range(ELLIPSE_STEPS)])]
+	return []
+
+def convert_svg(chunk: list) -> str:
+	'Returns document text of SVG shapes chunk. Runs in worker process'
+	lines = []
+	for tag, attrs, layer, (a, b, c, d, e, f) in chunk:
+		try:
+			shape_lines = svg_shape_lines(tag, attrs)
+		except ValueError:
+			continue  # malformed shape
+		for closed, points in shape_lines:
+			lines.append((Layers[layer], closed, [(round(a * x + c * y + e), round(b * x + d * y + f)) for x, y in points]))
+	return serialize_lines(lines)
+
+
+# DXF
+
+def read_dxf_pairs(source: str | BinaryIO):
+	'Yields DXF (group code, value) pairs'
+	with io.TextIOWrapper(open(source, 'rb') if isinstance(source, str) else source, encoding='utf-8', errors='replace') as f:
+		while(code := f.readline()):
+			value = f.readline()
+			try:
+				yield int(code), value.strip()
+			except ValueError:
+				continue  # malformed group code
+
+def scan_dxf(source: str | BinaryIO, chunk_size=CHUNK_SIZE):
+	'''Yields chunks of DXF entities of ENTITIES section: [(entity type, [(group code, value), ...]), ...]
+	POLYLINE entity includes its VERTEX entities'''
+	chunk, entity, in_entities, polyline = [], None, False, False
+	for code, value in read_dxf_pairs(source):
+		if code == 2 and entity is None and value == 'ENTITIES':
+			in_entities = True
+			continue
+		if not in_entities:
+			continue
+		if code == 0:
+			if polyline and value in ('VERTEX', 'SEQEND'):
+				# POLYLINE vertices # part of POLYLINE entity
+				polyline = value == 'VERTEX'
+				entity[1].append((0, value))
+				continue
+			if entity:
+				chunk.append(entity)
+				if len(chunk) >= chunk_size:
+					yield chunk
+					chunk = []
+			if value == 'ENDSEC':
+				break
+			entity, polyline = (value, []), value == 'POLYLINE'
+		elif entity:
+			entity[1].append((code, value))
+	if not in_entities:
+		raise ValueError('Malformed DXF: no ENTITIES section')
+	if chunk:
+		yield chunk
+
+def convert_dxf(chunk: list) -> str:
+	'Returns document text of DXF entities chunk. Runs in worker process. DXF layer name is used for document layer'
+	lines = []
+	for kind, pairs in chunk:
+		layer, closed, xs, ys = DEFAULT_LAYER, False, [], []
+		vertex = kind != 'POLYLINE'  # POLYLINE coordinates are in VERTEX entities
+		header = True  # entity group codes, not VERTEX ones
+		try:
+			for code, value in pairs:
+				match code:
+					case 0:
+						vertex, header = value == 'VERTEX', False
+					case 8 if header:
+						layer = get_layer(value) or DEFAULT_LAYER
+					case 70 if header:
+						closed = bool(int(value) & 1)
+					case 10 | 11 if vertex:
+						xs.append(float(value))
+					case 20 | 21 if vertex:
+						ys.append(float(value))
+		except ValueError:
+			continue  # malformed entity
+		if kind in ('LINE', 'LWPOLYLINE', 'POLYLINE'):
+			lines.append((layer, closed and kind != 'LINE', [(round(x), round(y)) for x, y in zip(xs, ys)]))
+	return serialize_lines(lines)
+
+
+IMPORTERS = {'svg': (scan_svg, convert_svg), 'dxf': (scan_dxf, convert_dxf)}
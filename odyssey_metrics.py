@@ -0,0 +1,133 @@
+'''Odyssey Web server metrics in Prometheus text format. Metrics are collected per server worker process:
+registry labels (e.g. worker pid) are added to every sample, so series of workers are distinct'''
+
+from math import isfinite
+from threading import Lock
+
+
+# latency buckets, seconds # client side uses the same buckets in ms (see static/odyssey_web_base.py)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1., 2., 5.)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+
+def format_labels(labels: tuple[tuple[str, str], ...], extra: str = '') -> str:
+	items = [f'{k}="{v}"' for k, v in labels]
+	if extra:
+		items.append(extra)
+	return '{' + ','.join(items) + '}' if items else ''
+
+def format_value(value: float) -> str:
+	return str(int(value)) if value == int(value) else repr(float(value))
+
+
+class Metric:
+
+	TYPE = ''
+
+	def __init__(self, name: str, help: str):
+		self.name, self.help = name, help
+		self.lock = Lock()
+		self.const_labels: tuple[tuple[str, str], ...] = ()  # labels of every sample # set by registry
+
+	def render(self) -> str:
+		return f'# HELP {self.name} {self.help}\n# TYPE {self.name} {self.TYPE}\n' + ''.join(self.render_samples())
+
+	def render_samples(self):
+		return ()
+
+
+class Gauge(Metric):
+	'Metric with values set by labels'
+
+	TYPE = 'gauge'
+
+	def __init__(self, name: str, help: str):
+		super().__init__(name, help)
+		self.values: dict[tuple, float] = {}
+
+	def set(self, value: float, **labels):
+		with self.lock:
+			self.values[tuple(sorted(labels.items()))] = value
+
+	def render_samples(self):
+		with self.lock:
+			values = list(self.values.items())
+		for labels, value in values:
+			yield f'{self.name}{format_labels(self.const_labels + labels)} {format_value(value)}\n'
+
+
+class Counter(Gauge):
+
+	TYPE = 'counter'
+
+
+class Histogram(Metric):
+
+	TYPE = 'histogram'
+
+	def __init__(self, name: str, help: str, buckets: tuple[float, ...]):
+		super().__init__(name, help)
+		self.buckets = buckets
+		self.values: dict[tuple, list] = {}  # labels: [buckets counts (not cumulative) + inf bucket count, sum]
+
+	def _get(self, labels: dict) -> list:
+		'Called under lock'
+		key = tuple(sorted(labels.items()))
+		if not (v := self.values.get(key)):
+			v = self.values[key] = [[0] * (len(self.buckets) + 1), 0.]
+		return v
+
+	def observe(self, value: float, **labels):
+		i = 0
+		while i < len(self.buckets) and value > self.buckets[i]:
+			i += 1
+		with self.lock:
+			v = self._get(labels)
+			v[0][i] += 1
+			v[1] += value
+
+	def check(self, counts: list[int], sum: float):
+		'Raises ValueError if histogram aggregate is not mergeable: buckets mismatch, negative or not integer count, invalid sum'
+		if not isinstance(counts, list) or len(counts) != len(self.buckets) + 1:
+			raise ValueError(f'{self.name}: {len(self.buckets) + 1} buckets expected')
+		if not all(type(x) is int and x >= 0 for x in counts):
+			raise ValueError(f'{self.name}: non-negative integer counts expected')
+		if type(sum) not in (int, float) or not isfinite(sum) or sum < 0:
+			raise ValueError(f'{self.name}: non-negative sum expected')
+
+	def merge(self, counts: list[int], sum: float, **labels):
+		'Adds histogram aggregate with the same buckets. Raises ValueError for invalid aggregate (see check)'
+		self.check(counts, sum)
+		with self.lock:
+			v = self._get(labels)
+			for i, c in enumerate(counts):
+				v[0][i] += c
+			v[1] += sum
+
+	def render_samples(self):
+		with self.lock:
+			values = [(k, list(v[0]), v[1]) for k, v in self.values.items()]
+		for labels, counts, sum in values:
+			labels = self.const_labels + labels
+			total = 0
+			for le, c in zip(self.buckets + ('+Inf',), counts):
+				total += c
+				bucket_labels = format_labels(labels, f'le="{le}"')
+				yield f'{self.name}_bucket{bucket_labels} {total}\n'
+			yield f'{self.name}_sum{format_labels(labels)} {format_value(sum)}\n'
+			yield f'{self.name}_count{format_labels(labels)} {total}\n'
+
+
+class Registry:
+
+	def __init__(self, **labels):
+		self.labels = tuple(sorted((k, str(v)) for k, v in labels.items()))  # labels of every sample
+		self.metrics: list[Metric] = []
+
+	def add(self, metric: Metric) -> Metric:
+		metric.const_labels = self.labels
+		self.metrics.append(metric)
+		return metric
+
+	def render(self) -> str:
+		return ''.join(x.render() for x in self.metrics)
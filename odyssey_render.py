@@ -0,0 +1,176 @@
+'''Odyssey Web documents render without browser: standalone SVG & PNG thumbnail.
+Renders are cached by content hash of document, cache is shared by all worker processes'''
+
+import os
+import re
+import struct
+import zlib
+from hashlib import sha256
+from threading import Lock, get_ident
+from xml.sax.saxutils import quoteattr
+# Odyssey Web imports
+from odyssey_document import Document, Layers
+
+
+RENDER_VERSION = 1  # change to invalidate cached renders
+MARGIN = 10  # SVG margin, px
+THUMBNAIL_SIZE = 256
+THUMBNAIL_MARGIN = 4
+
+# layer styles: stroke color (see client side LineTool.DEFAULT_COLOR)
+LAYER_STYLES = {
+	Layers.Electric: {'stroke': (216, 144, 0)},
+	Layers.Stamp: {'stroke': (77, 144, 254)},
+	Layers.Draw: {'stroke': (0, 128, 0)},
+	Layers.Notes: {'stroke': (153, 153, 153)},
+}
+FORMATS = {'svg': 'image/svg+xml', 'png': 'image/png'}
+
+
+def get_bounds(doc: Document) -> tuple[int, int, int, int] | None:
+	'Returns document bounds (x1, y1, x2, y2) or None for empty document'
+	xs = [x for item in doc for x, _ in item.points]
+	ys = [y for item in doc for _, y in item.points]
+	return (min(xs), min(ys), max(xs), max(ys)) if xs else None
+
+def render_svg(doc: Document) -> bytes:
+	'Returns standalone SVG of document. Objects are grouped by layer'
+	x1, y1, x2, y2 = get_bounds(doc) or (0, 0, 0, 0)
+	x1, y1, width, height = x1 - MARGIN, y1 - MARGIN, x2 - x1 + 2 * MARGIN, y2 - y1 + 2 * MARGIN
+	ret = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="{x1} {y1} {width} {height}">\n']
+	for layer in Layers:
+		if not (items := [x for x in doc if x.layer == layer]):
+			continue
+		r, g, b = LAYER_STYLES[layer]['stroke']
+		ret.append(f'<g id={quoteattr(layer.name)} fill="none" stroke="#{r:02x}{g:02x}{b:02x}" stroke-linejoin="round">\n')
+		for item in items:
+			points = ' '.join(f'{x},{y}' for x, y in item.points)
+			ret.append(f'<{"polygon" if item.closed else "polyline"} id={quoteattr(item.id)} stroke-width={quoteattr(str(item.width))} points={quoteattr(points)}/>\n')
+		ret.append('</g>\n')
+	ret.append('</svg>\n')
+	return ''.join(ret).encode()
+
+def render_png(doc: Document, size=THUMBNAIL_SIZE) -> bytes:
+	'Returns PNG thumbnail of document: size x size px, transparent background'
+	pixels = bytearray(size * size * 4)  # RGBA
+	if(bounds := get_bounds(doc)):
+		x1, y1, x2, y2 = bounds
+		scale = (size - 2 * THUMBNAIL_MARGIN - 1) / max(x2 - x1, y2 - y1, 1)
+		# center document
+		ox = (size - (x2 - x1) * scale) / 2 - x1 * scale
+		oy = (size - (y2 - y1) * scale) / 2 - y1 * scale
+		for item in doc:
+			color = bytes(LAYER_STYLES[item.layer]['stroke']) + b'\xff'
+			points = [(round(x * scale + ox), round(y * scale + oy)) for x, y in item.points]
+			if item.closed and len(points) > 2:
+				points.append(points[0])
+			for p1, p2 in zip(points[:-1], points[1:]):
+				draw_line(pixels, size, p1, p2, color)
+	return encode_png(pixels, size, size)
+
+def draw_line(pixels: bytearray, size: int, p1: tuple[int, int], p2: tuple[int, int], color: bytes):
+	'Draws line by Bresenham algorithm'
+	(x, y), (x2, y2) = p1, p2
+	dx, dy = abs(x2 - x), -abs(y2 - y)
+	sx, sy = 1 if x < x2 else -1, 1 if y < y2 else -1
+	err = dx + dy
+	while True:
+		if 0 <= x < size and 0 <= y < size:
+			i = (y * size + x) * 4
+			pixels[i:i + 4] = color
+		if x == x2 and y == y2:
+			return
+		if(e2 := 2 * err) >= dy:
+			err += dy
+			x += sx
+		if e2 <= dx:
+			err += dx
+			y += sy
+
+def encode_png(pixels: bytearray, width: int, height: int) -> bytes:
+	'Returns PNG of RGBA pixels'
+	def chunk(kind: bytes, data: bytes) -> bytes:
+		return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+	stride = width * 4
+	# filter type 0 (none) for every row
+	raw = b''.join(b'\x00' + pixels[y * stride:(y + 1) * stride] for y in range(height))
+	return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))\
+		+ chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b'')
+
+def render_document(text: str, format: str, size=THUMBNAIL_SIZE) -> bytes:
+	'Returns render of document text. Runs in worker process'
+	doc = Document.parse(text)
+	return render_png(doc, size) if format == 'png' else render_svg(doc)
+
+
+class RenderCache:
+	'''Content addressed renders: one file per render in directory, file name is hash of render parameters & document.
+	Least recently used renders are removed to fit size budget'''
+
+	NAME_RE = re.compile(r'[0-9a-f]{32}\.(svg|png)')
+	DEFAULT_BUDGET = 256 * 1024 * 1024
+
+	def __init__(self, path: str, budget=DEFAULT_BUDGET):
+		self.path, self.budget = path, budget
+		self.lock = Lock()
+		os.makedirs(path, exist_ok=True)
+		self.size = self.get_size()  # estimated directory size, other workers writes are not counted until eviction
+
+	@classmethod
+	def get_name(cls, text: str, format: str, size=THUMBNAIL_SIZE) -> str:
+		'Returns render file name: content hash'
+		params = f'{RENDER_VERSION}:{format}:{size if format == "png" else ""}:'
+		return sha256(params.encode() + text.encode()).hexdigest()[:32] + '.' + format
+
+	@classmethod
+	def is_valid_name(cls, name: str) -> bool:
+		return bool(cls.NAME_RE.fullmatch(name))
+
+	def get(self, name: str) -> bytes | None:
+		path = os.path.join(self.path, name)
+		try:
+			with open(path, 'rb') as f:
+				data = f.read()
+			os.utime(path)  # recently used
+		except FileNotFoundError:
+			return None
+		return data
+
+	def put(self, name: str, data: bytes):
+		path = os.path.join(self.path, name)
+		tmp_path = f'{path}.{os.getpid()}.{get_ident()}.tmp'
+		with open(tmp_path, 'wb') as f:
+			f.write(data)
+		os.replace(tmp_path, path)
+		with self.lock:
+			self.size += len(data)
+			evict = self.size > self.budget
+		if evict:
+			self.evict()
+
+	def get_size(self) -> int:
+		return sum(x.stat().st_size for x in os.scandir(self.path) if self.is_valid_name(x.name))
+
+	def evict(self):
+		'Removes least recently used renders to fit 90% of budget'
+		with self.lock:
+			files = []
+			for x in os.scandir(self.path):
+				if not self.is_valid_name(x.name):
+					continue  # render in progress
+				try:
+					st = x.stat()
+				except FileNotFoundError:
+					continue  # removed by another worker
+				files.append((st.st_mtime, st.st_size, x.path))
+			files.sort()
+			size = sum(x[1] for x in files)
+			for _, file_size, path in files:
+				if size <= self.budget * 0.9:
+					break
+				try:
+					os.remove(path)
+				except FileNotFoundError:
+					pass
+				size -= file_size
+			self.size = size
@@ -0,0 +1,494 @@
+'Odyssey Web server side documents storage'
+
+import fcntl
+import json
+import os
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import Condition, Lock, Thread, get_ident
+from time import monotonic
+# Odyssey Web imports
+from odyssey_document import ID_RE, Document
+
+
+class ConflictError(Exception):
+	'Document is changed since expected revision'
+
+
+class DocumentStore:
+	'Documents storage: one file per document in directory. Shared by all server worker processes'
+
+	SUFFIX = '.odg'
+	ID_RE = ID_RE
+
+	def __init__(self, path: str):
+		self.path = path
+		os.makedirs(path, exist_ok=True)
+
+	@classmethod
+	def is_valid_id(cls, doc_id: str) -> bool:
+		'Document ID is used as file name, so only URL safe base64 alphabet is allowed'
+		return bool(cls.ID_RE.fullmatch(doc_id))
+
+	def get_path(self, doc_id: str) -> str:
+		return os.path.join(self.path, doc_id + self.SUFFIX)
+
+	def list_ids(self) -> list[str]:
+		'Returns stored documents IDs'
+		return sorted(x.name.removesuffix(self.SUFFIX) for x in os.scandir(self.path) if x.name.endswith(self.SUFFIX))
+
+	def revision(self, doc_id: str) -> str | None:
+		'Returns document revision or None if document not exists. Revision changes on every save by any process'
+		try:
+			st = os.stat(self.get_path(doc_id))
+		except FileNotFoundError:
+			return None
+		return self.stat_revision(st)
+
+	def load(self, doc_id: str) -> tuple[str, str] | None:
+		'Returns (document text, revision) or None if document not exists'
+		try:
+			with open(self.get_path(doc_id), encoding='utf-8') as f:
+				st = os.fstat(f.fileno())
+				text = f.read()
+		except FileNotFoundError:
+			return None
+		return text, self.stat_revision(st)
+
+	def save(self, doc_id: str, text: str, doc: Document | None = None, base: tuple[Document, str] | None = None,
+			expected: str | None = None) -> str:
+		'''Saves document atomically: readers see either old or new document. Returns new revision.
+		doc - parsed text, base - (document, revision) of previous save: used by JournalStore.
+		expected - revision of document to replace: ConflictError is raised if document is changed (not atomic)'''
+		if expected is not None and self.revision(doc_id) != expected:
+			raise ConflictError(doc_id)
+		path = self.get_path(doc_id)
+		tmp_path = f'{path}.{os.getpid()}.{get_ident()}.tmp'
+		with open(tmp_path, 'w', encoding='utf-8') as f:
+			f.write(text)
+			f.flush()
+			os.fsync(f.fileno())
+			st = os.fstat(f.fileno())
+		os.replace(tmp_path, path)  # rename keeps inode & mtime
+		return self.stat_revision(st)
+
+	def close(self):
+		pass
+
+	@classmethod
+	def stat_revision(cls, st: os.stat_result) -> str:
+		# save replaces file # new inode for every save
+		return f'{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}'
+
+
+class JournalStore(DocumentStore):
+	'''Documents storage: document snapshot file & append-only journal of changes per document.
+	Save appends one journal line of operations (see Document.diff) with changed objects only, so save cost does not depend on document size.
+	Load replays journal over snapshot. Torn last line of crashed save is ignored on load & cut on the next save.
+	Journals are fsync-ed in batches by background thread every sync_interval seconds (0 - fsync on every save).
+	Journal is compacted into snapshot in background when bigger than compact_ratio of snapshot size.
+	Compaction writes snapshot before journal truncation: operations set objects state, so crash between
+	is recovered by replay of the whole journal over new snapshot.
+	Journal file lock serializes journal writes & reads of all processes. Documents without journal are loaded as is'''
+
+	JOURNAL_SUFFIX = '.odj'
+	DEFAULT_SYNC_INTERVAL = 0.05
+	DEFAULT_COMPACT_RATIO = 1.
+	COMPACT_MIN_SIZE = 64 * 1024  # journal is not compacted while smaller, bytes
+
+	def __init__(self, path: str, sync_interval=DEFAULT_SYNC_INTERVAL, compact_ratio=DEFAULT_COMPACT_RATIO):
+		super().__init__(path)
+		self.sync_interval, self.compact_ratio = sync_interval, compact_ratio
+		self.cond = Condition()
+		self.unsynced: set[str] = set()  # document IDs of journals to fsync
+		self.compact_queue: set[str] = set()  # document IDs of journals to compact
+		self.compacted: dict[str, tuple[str, str]] = {}  # document ID: (revision before, revision after) of last compaction by this process
+		self.stats = {'appends': 0, 'syncs': 0, 'compactions': 0}
+		self.running = True
+		self.thread = Thread(target=self._background, name='JournalStore background', daemon=True)
+		self.thread.start()
+
+	def get_journal_path(self, doc_id: str) -> str:
+		return os.path.join(self.path, doc_id + self.JOURNAL_SUFFIX)
+
+	def list_ids(self) -> list[str]:
+		ret = set()
+		for x in os.scandir(self.path):
+			for suffix in (self.SUFFIX, self.JOURNAL_SUFFIX):
+				if x.name.endswith(suffix):
+					ret.add(x.name.removesuffix(suffix))
+		return sorted(ret)
+
+	def revision(self, doc_id: str) -> str | None:
+		try:
+			return self.stat_revision(os.stat(self.get_journal_path(doc_id)))  # journal is changed by every save
+		except FileNotFoundError:
+			return super().revision(doc_id)
+
+	def load(self, doc_id: str) -> tuple[str, str] | None:
+		try:
+			f = open(self.get_journal_path(doc_id), 'rb')
+		except FileNotFoundError:
+			return super().load(doc_id)
+		with f:
+			fcntl.flock(f, fcntl.LOCK_SH)
+			st = os.fstat(f.fileno())
+			doc = self._replay(doc_id, f.read())
+		return doc.serialize(), self.stat_revision(st)
+
+	def save(self, doc_id: str, text: str, doc: Document | None = None, base: tuple[Document, str] | None = None,
+			expected: str | None = None) -> str:
+		'''Appends changes since base to journal. Document is written in full if base is not the current revision.
+		expected revision is checked under journal lock'''
+		if doc is None:
+			doc = Document.parse(text)
+		path = self.get_journal_path(doc_id)
+		try:
+			fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT | os.O_EXCL, 0o644)
+			created = True
+		except FileExistsError:
+			fd = os.open(path, os.O_RDWR | os.O_APPEND)
+			created = False
+		try:
+			fcntl.flock(fd, fcntl.LOCK_EX)
+			st = os.fstat(fd)
+			revision = super().revision(doc_id) if created else self.stat_revision(st)
+			if expected is not None and expected != revision and self.compacted.get(doc_id) != (expected, revision):
+				if created:
+					os.remove(path)
+				raise ConflictError(doc_id)
+			if base and (base[1] == revision or self.compacted.get(doc_id) == (base[1], revision)):
+				ops = doc.diff(base[0])
+			else:
+				# unknown base or saved by another process since base
+				ops = [['clear']] + [['add', x.snapshot()] for x in doc]
+			if ops:
+				if st.st_size and os.pread(fd, 1, st.st_size - 1) != b'\n':
+					# torn line of crashed save
+					os.ftruncate(fd, os.pread(fd, st.st_size, 0).rfind(b'\n') + 1)
+				os.write(fd, json.dumps(ops, separators=(',', ':')).encode() + b'\n')
+				if not self.sync_interval:
+					os.fsync(fd)
+				st = os.fstat(fd)
+		finally:
+			os.close(fd)
+		compact = st.st_size > self.COMPACT_MIN_SIZE and st.st_size > self._get_snapshot_size(doc_id) * self.compact_ratio
+		with self.cond:
+			if ops:
+				self.stats['appends'] += 1
+				if self.sync_interval:
+					self._schedule(self.unsynced, doc_id)
+			if compact:
+				self._schedule(self.compact_queue, doc_id)
+		return self.stat_revision(st)
+
+	def compact(self, doc_id: str):
+		'Writes document snapshot & truncates journal'
+		try:
+			f = open(self.get_journal_path(doc_id), 'r+b')
+		except FileNotFoundError:
+			return
+		with f:
+			fcntl.flock(f, fcntl.LOCK_EX)
+			if not (data := f.read()):
+				return
+			revision = self.stat_revision(os.fstat(f.fileno()))
+			super().save(doc_id, self._replay(doc_id, data).serialize())
+			f.truncate(0)
+			f.flush()
+			os.fsync(f.fileno())
+			compacted = revision, self.stat_revision(os.fstat(f.fileno()))
+		with self.cond:
+			self.compacted[doc_id] = compacted  # document is not changed by compaction
+			self.stats['compactions'] += 1
+
+	def close(self):
+		'Stops background thread, fsyncs journals & runs pending compactions'
+		with self.cond:
+			self.running = False
+			self.cond.notify()
+		self.thread.join()
+
+	def _replay(self, doc_id: str, journal: bytes) -> Document:
+		'Returns snapshot with journal applied. Called under journal lock'
+		doc = (loaded := super().load(doc_id)) and Document.parse(loaded[0]) or Document()
+		lines = journal.split(b'\n')
+		for n, line in enumerate(lines[:-1], 1):  # last is empty or torn line
+			try:
+				doc.apply(json.loads(line))
+			except (KeyError, TypeError, ValueError) as e:
+				raise ValueError(f'Document {doc_id} journal line {n}: {e}') from None
+		return doc
+
+	def _schedule(self, queue: set[str], doc_id: str):
+		'Adds document to background thread queue. Called under lock'
+		if not self.unsynced and not self.compact_queue:
+			self.cond.notify()
+		queue.add(doc_id)
+
+	def _get_snapshot_size(self, doc_id: str) -> int:
+		try:
+			return os.stat(self.get_path(doc_id)).st_size
+		except FileNotFoundError:
+			return 0
+
+	def _sync(self, doc_id: str):
+		fd = os.open(self.get_journal_path(doc_id), os.O_RDONLY)
+		try:
+			os.fsync(fd)
+		finally:
+			os.close(fd)
+
+	def _background(self):
+		'Background thread: batched journals fsync & compaction'
+		while True:
+			with self.cond:
+				while self.running and not self.unsynced and not self.compact_queue:
+					self.cond.wait()
+				if self.running:
+					self.cond.wait(self.sync_interval)  # collect saves to sync in batch
+				running = self.running
+				unsynced, self.unsynced = self.unsynced, set()
+				compact, self.compact_queue = self.compact_queue, set()
+				self.stats['syncs'] += len(unsynced)
+			for doc_id, func in [(x, self._sync) for x in unsynced] + [(x, self.compact) for x in compact]:
+				try:
+					func(doc_id)
+				except (OSError, ValueError) as e:
+					print(f'Document {doc_id} journal {func.__name__} error: {e}')
+			if not running:
+				return
+
+
+class LruCache:
+	'Thread safe LRU cache with memory budget'
+
+	def __init__(self, budget: int):
+		self.budget = budget
+		self.lock = Lock()
+		self.entries: OrderedDict[object, tuple[object, int]] = OrderedDict()  # key: (value, size)
+		self.size = 0
+
+	def get(self, key) -> object | None:
+		with self.lock:
+			if(entry := self.entries.get(key)):
+				self.entries.move_to_end(key)
+				return entry[0]
+		return None
+
+	def put(self, key, value, size: int):
+		with self.lock:
+			if(old := self.entries.pop(key, None)):
+				self.size -= old[1]
+			self.entries[key] = value, size
+			self.size += size
+			while self.size > self.budget and len(self.entries) > 1:
+				_, (_, size) = self.entries.popitem(last=False)
+				self.size -= size
+
+
+class DocumentCache:
+	'''Worker process LRU cache of parsed documents with write-behind flushing to store.
+	Store is the shared state of all workers: clean cache entry is valid while store revision is not changed,
+	so a flushed save by one worker invalidates entries of the other workers.
+	Dirty entry is flushed after flush_delay seconds without saves (debounce), but not later than flush_delay_max
+	seconds after the first unflushed save. Zero flush_delay is write-through.
+	Document revision for clients is content hash of document text: the same in all workers & after restart, not changed by flush'''
+
+	DEFAULT_BUDGET = 256 * 1024 * 1024
+	DEFAULT_FLUSH_DELAY = 1.0
+	FLUSH_DELAY_MAX_FACTOR = 10
+
+
+	class Entry:
+
+		__slots__ = ('doc', 'text', 'revision', 'store_revision', 'base', 'size', 'dirty_since', 'changed')
+
+		def __init__(self, doc: Document, text: str, store_revision: str | None):
+			self.doc, self.text = doc, text  # parsed document & serialized document
+			self.revision = blake2b(text.encode(), digest_size=12).hexdigest()  # document revision for clients
+			self.store_revision = store_revision  # store revision of cached document
+			self.base: Document | None = None  # document of store revision if dirty # changes since base are written by flush
+			self.size = doc.get_size() + len(text)
+			self.dirty_since: float | None = None  # time of the first unflushed save
+			self.changed = 0.  # time of the last save
+
+
+	def __init__(self, store: DocumentStore, budget=DEFAULT_BUDGET, flush_delay=DEFAULT_FLUSH_DELAY):
+		self.store = store
+		self.budget, self.flush_delay = budget, flush_delay
+		self.flush_delay_max = flush_delay * self.FLUSH_DELAY_MAX_FACTOR
+		self.lock = Lock()
+		self.flush_cond = Condition(self.lock)
+		self.entries: OrderedDict[str, DocumentCache.Entry] = OrderedDict()  # LRU order: last used at end
+		self.size = 0  # entries memory size, bytes
+		self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'saves': 0, 'flushes': 0, 'conflicts': 0}
+		self.flusher: Thread | None = None
+		if flush_delay > 0:
+			self.flusher = Thread(target=self._flusher, name='DocumentCache flusher', daemon=True)
+			self.flusher.start()
+
+	def get(self, doc_id: str) -> tuple[Document, str] | None:
+		'Returns (parsed document, revision) or None if document not exists'
+		if(entry := self._get(doc_id)):
+			return entry.doc, entry.revision
+		return None
+
+	def get_text(self, doc_id: str) -> tuple[str, str] | None:
+		'Returns (serialized document, revision) or None if document not exists'
+		if(entry := self._get(doc_id)):
+			return entry.text, entry.revision
+		return None
+
+	def get_document(self, doc_id: str) -> tuple[Document, str, str] | None:
+		'Returns (parsed document, serialized document, revision) or None if document not exists'
+		if(entry := self._get(doc_id)):
+			return entry.doc, entry.text, entry.revision
+		return None
+
+	def put(self, doc_id: str, text: str, revision: str | None = None) -> str:
+		'''Saves document. Returns new revision. Raises ValueError for malformed document.
+		revision - revision of document to replace: ConflictError is raised if document is changed since'''
+		doc = Document.parse(text)
+		entry = self.Entry(doc, doc.serialize(), None)  # normalized text: same revision of document loaded by other workers
+		current = self._get(doc_id) if revision is not None else None  # revalidated with store
+		with self.lock:
+			old = self.entries.get(doc_id)
+			if revision is not None and (not current or old is not current or current.revision != revision):
+				self.stats['conflicts'] += 1
+				raise ConflictError(doc_id)
+			if old:
+				entry.store_revision, entry.dirty_since = old.store_revision, old.dirty_since
+				entry.base = old.base if old.dirty_since is not None else old.doc
+			entry.changed = monotonic()
+			if entry.dirty_since is None:
+				entry.dirty_since = entry.changed
+			self._set(doc_id, entry)
+			self.stats['saves'] += 1
+			if self.flusher:
+				self.flush_cond.notify()
+		if not self.flusher:
+			# write-through # other workers may save since revalidation: store checks revision under its lock
+			self._flush(doc_id, entry, revision is not None)
+		self._evict()
+		return entry.revision
+
+	def get_stats(self) -> dict:
+		with self.lock:
+			return dict(self.stats, entries=len(self.entries), size=self.size, budget=self.budget,
+				dirty=sum(1 for x in self.entries.values() if x.dirty_since is not None))
+
+	def flush(self):
+		'Flushes all dirty entries'
+		with self.lock:
+			dirty = [(k, v) for k, v in self.entries.items() if v.dirty_since is not None]
+		for doc_id, entry in dirty:
+			self._flush(doc_id, entry)
+
+	def close(self):
+		'Stops background flushing, flushes all dirty entries & closes store'
+		if(flusher := self.flusher):
+			with self.lock:
+				self.flusher = None
+				self.flush_cond.notify()
+			flusher.join()
+		self.flush()
+		self.store.close()
+
+	def _get(self, doc_id: str) -> Entry | None:
+		with self.lock:
+			if(entry := self.entries.get(doc_id)) and entry.dirty_since is not None:
+				# unflushed save # cache is authoritative
+				self.entries.move_to_end(doc_id)
+				self.stats['hits'] += 1
+				return entry
+		store_revision = self.store.revision(doc_id)
+		with self.lock:
+			if(entry := self.entries.get(doc_id)) and (entry.dirty_since is not None or entry.store_revision == store_revision):
+				self.entries.move_to_end(doc_id)
+				self.stats['hits'] += 1
+				return entry
+			self.stats['misses'] += 1
+			if not store_revision and entry:
+				# document removed from store
+				self._set(doc_id, None)
+		if not store_revision:
+			return None
+		# entry is absent or invalidated by another worker # reload from store
+		if not (loaded := self.store.load(doc_id)):
+			return None
+		text, store_revision = loaded
+		entry = self.Entry(Document.parse(text), text, store_revision)
+		with self.lock:
+			if(old := self.entries.get(doc_id)) and old.dirty_since is not None:
+				return old  # saved while loading
+			self._set(doc_id, entry)
+		self._evict()
+		return entry
+
+	def _set(self, doc_id: str, entry: Entry | None):
+		'Replaces entry. Called under lock'
+		if(old := self.entries.pop(doc_id, None)):
+			self.size -= old.size
+		if entry:
+			self.entries[doc_id] = entry
+			self.size += entry.size
+
+	def _evict(self):
+		'Evicts least recently used entries to fit memory budget. Dirty entry is flushed before eviction'
+		while True:
+			with self.lock:
+				if self.size <= self.budget or len(self.entries) <= 1:
+					return
+				doc_id, entry = next(iter(self.entries.items()))
+				if entry.dirty_since is None:
+					self._set(doc_id, None)
+					self.stats['evictions'] += 1
+					continue
+			self._flush(doc_id, entry)
+
+	def _flush(self, doc_id: str, entry: Entry, strict=False):
+		'Writes entry to store. strict - store revision must be the entry store revision: ConflictError is raised otherwise'
+		base = (entry.base, entry.store_revision) if entry.base else None
+		try:
+			store_revision = self.store.save(doc_id, entry.text, entry.doc, base, entry.store_revision if strict else None)
+		except ConflictError:
+			with self.lock:
+				self.stats['conflicts'] += 1
+				if self.entries.get(doc_id) is entry:
+					self._set(doc_id, None)  # saved by another worker # reloaded by next read
+			raise
+		with self.lock:
+			self.stats['flushes'] += 1
+			if self.entries.get(doc_id) is entry:
+				# no saves while writing # entry is clean now
+				entry.store_revision = store_revision
+				entry.dirty_since, entry.base = None, None
+			elif(current := self.entries.get(doc_id)) and current.dirty_since is not None:
+				# saved while writing # next flush writes changes since this write
+				current.store_revision, current.base = store_revision, entry.doc
+
+	def _flusher(self):
+		'Background flushing thread'
+		while True:
+			with self.lock:
+				if not self.flusher:
+					return
+				now, timeout, ready = monotonic(), None, []
+				for doc_id, entry in self.entries.items():
+					if entry.dirty_since is not None:
+						flush_time = min(entry.changed + self.flush_delay, entry.dirty_since + self.flush_delay_max)
+						if flush_time <= now:
+							ready.append((doc_id, entry))
+						elif timeout is None or flush_time - now < timeout:
+							timeout = flush_time - now
+				if not ready:
+					self.flush_cond.wait(timeout)
+					continue
+			for doc_id, entry in ready:
+				try:
+					self._flush(doc_id, entry)
+				except OSError as e:
+					print(f'Document {doc_id} flush error: {e}')
+					with self.lock:
+						entry.changed = monotonic()  # retry after flush delay
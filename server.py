@@ -1,8 +1,22 @@
-
-from fastapi import FastAPI, Request
+import os
+import math
+import json
+import asyncio
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from starlette.routing import Match
+# Odyssey Web imports
+from odyssey_storage import ConflictError, DocumentStore, JournalStore, DocumentCache, LruCache
+from odyssey_metrics import Registry, Counter, Gauge, Histogram, LATENCY_BUCKETS, SIZE_BUCKETS
+from odyssey_import import IMPORTERS
+from odyssey_render import FORMATS, THUMBNAIL_SIZE, RenderCache, render_document
 
 
 app = FastAPI()
@@ -10,7 +24,315 @@ app = FastAPI()
 app.mount('/static', StaticFiles(directory='static'), name='static')
 templates = Jinja2Templates(directory='templates')
 
+# server worker processes count (see server_run.sh)
+server_workers = int(os.environ.get('ODYSSEY_WORKERS', 1))
+
+# documents directory is shared by all worker processes
+# write-behind is single worker only: delayed write of one worker may overwrite a newer save of another worker
+documents = DocumentCache(JournalStore(os.environ.get('ODYSSEY_DOCUMENTS', 'documents'),
+		sync_interval=float(os.environ.get('ODYSSEY_SYNC_INTERVAL', JournalStore.DEFAULT_SYNC_INTERVAL)),
+		compact_ratio=float(os.environ.get('ODYSSEY_COMPACT_RATIO', JournalStore.DEFAULT_COMPACT_RATIO))),
+	budget=int(os.environ.get('ODYSSEY_CACHE_BUDGET', DocumentCache.DEFAULT_BUDGET)),
+	flush_delay=float(os.environ.get('ODYSSEY_FLUSH_DELAY', DocumentCache.DEFAULT_FLUSH_DELAY)) if server_workers == 1 else 0.)
+
+# editor sends timing metrics to server
+client_metrics = os.environ.get('ODYSSEY_CLIENT_METRICS', '') == '1'
+
+# content addressed documents renders, shared by all worker processes
+renders = RenderCache(os.environ.get('ODYSSEY_RENDER_CACHE', os.path.join('cache', 'render')),
+	int(os.environ.get('ODYSSEY_RENDER_CACHE_BUDGET', RenderCache.DEFAULT_BUDGET)))
+THUMBNAIL_SIZES = range(16, 1025)
+EXPORT_BATCH_MAX = 1000
+
+# worker processes pool for CPU bound tasks: documents import & render # created on first use
+# every server worker has its own pool: CPUs are shared by server workers
+pool: ProcessPoolExecutor | None = None
+pool_workers = int(os.environ.get('ODYSSEY_POOL_WORKERS', 0)) or max(1, (os.cpu_count() or 1) // server_workers)
+
+DEFAULT_DOC_ID = 'untitled'
+# rendered editor pages with embedded document state: doc_id: (revision, html)
+pages = LruCache(int(os.environ.get('ODYSSEY_PAGES_BUDGET', 64 * 1024 * 1024)))
+# max size of document text embedded into editor page # bigger documents are opened from client cache
+embed_max = int(os.environ.get('ODYSSEY_EMBED_MAX', 1024 * 1024))
+
+metrics = Registry(pid=os.getpid())  # worker process metrics
+request_duration = metrics.add(Histogram('odyssey_http_request_duration_seconds', 'HTTP request latency', LATENCY_BUCKETS))
+request_size = metrics.add(Histogram('odyssey_http_request_size_bytes', 'HTTP request payload size', SIZE_BUCKETS))
+response_size = metrics.add(Histogram('odyssey_http_response_size_bytes', 'HTTP response payload size', SIZE_BUCKETS))
+cache_events = metrics.add(Counter('odyssey_document_cache_events_total', 'Document cache events'))
+cache_gauges = {x: metrics.add(Gauge(f'odyssey_document_cache_{x}', f'Document cache {x}'.replace('_', ' ')))
+	for x in ('entries', 'dirty', 'size_bytes', 'budget_bytes')}
+CLIENT_HANDLERS = {'on_mouse_move', 'on_pointer_down', 'on_pointer_up', 'on_key_down', 'commit', 'snapshot', 'serialize'}
+client_handler_duration = metrics.add(Histogram('odyssey_client_handler_duration_seconds', 'Editor handler latency', LATENCY_BUCKETS))
+client_gauges = {
+	'dom_nodes': metrics.add(Gauge('odyssey_client_dom_nodes', 'Editor SVG DOM nodes count')),
+	'document_objects': metrics.add(Gauge('odyssey_client_document_objects', 'Editor document objects count')),
+	'document_vertices': metrics.add(Gauge('odyssey_client_document_vertices', 'Editor document vertices count')),
+}
+
+
+def check_doc_id(doc_id: str):
+	if not DocumentStore.is_valid_id(doc_id):
+		raise HTTPException(status_code=400, detail='Invalid document ID')
+
+
+async def read_json_object(request: Request) -> dict:
+	'Returns JSON object of request body. Raises 400 for invalid JSON or not object'
+	try:
+		data = await request.json()
+	except ValueError:
+		raise HTTPException(status_code=400, detail='Invalid JSON') from None
+	if not isinstance(data, dict):
+		raise HTTPException(status_code=400, detail='JSON object expected')
+	return data
+
+
+def route_path(scope: dict) -> str:
+	'Returns path template of request route: bounded set of metrics labels'
+	for route in app.routes:
+		match, _ = route.matches(scope)
+		if match == Match.FULL:
+			return route.path
+	return 'other'
+
+
+@app.middleware('http')
+async def collect_metrics(request: Request, call_next):
+	start = perf_counter()
+	response = await call_next(request)
+	path = route_path(request.scope)
+	request_duration.observe(perf_counter() - start, method=request.method, path=path)
+	if(size := request.headers.get('content-length')):
+		request_size.observe(int(size), method=request.method, path=path)
+	if(size := response.headers.get('content-length')):
+		response_size.observe(int(size), method=request.method, path=path)
+	return response
+
+
+def get_pool() -> ProcessPoolExecutor:
+	global pool
+	if not pool:
+		pool = ProcessPoolExecutor(pool_workers)
+	return pool
+
+
+async def import_chunks(file, format: str, chunks, first: list | None):
+	'''Yields document text of imported file: file chunks iterator & its first chunk.
+	File chunks are converted by worker processes pool, order is kept. File is closed when done'''
+	convert = IMPORTERS[format][1]
+	loop, pending = asyncio.get_running_loop(), deque()
+	if first:
+		pending.append(loop.run_in_executor(get_pool(), convert, first))
+	try:
+		async for chunk in iterate_in_threadpool(chunks):
+			pending.append(loop.run_in_executor(get_pool(), convert, chunk))
+			# limit chunks in memory # yield converted chunks
+			while len(pending) > pool_workers * 2 or (pending and pending[0].done()):
+				yield await pending.popleft()
+		while pending:
+			yield await pending.popleft()
+	finally:
+		for f in pending:
+			f.cancel()
+		file.close()
+
+
+async def render(doc_id: str, format: str, size=THUMBNAIL_SIZE) -> tuple[str, bytes] | None:
+	'''Returns (render name, render) of document or None if document not exists.
+	Render is cached by document content hash, not cached render is made by worker processes pool'''
+	if not (doc := await run_in_threadpool(documents.get_text, doc_id)):
+		return None
+	text = doc[0]
+	name = RenderCache.get_name(text, format, size)
+	if(data := await run_in_threadpool(renders.get, name)) is None:
+		data = await asyncio.get_running_loop().run_in_executor(get_pool(), render_document, text, format, size)
+		await run_in_threadpool(renders.put, name, data)
+	return name, data
+
+
+def render_response(request: Request, name: str, data: bytes, immutable=False) -> Response:
+	headers = {'ETag': f'"{name}"'}
+	if immutable:
+		headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+	if request.headers.get('if-none-match') == headers['ETag']:
+		return Response(status_code=304, headers=headers)
+	return Response(data, media_type=FORMATS[name.rsplit('.', 1)[1]], headers=headers)
+
+
+def render_editor(doc_id: str) -> str:
+	'Returns editor page with embedded document state. Page is rendered once per document revision'
+	doc = documents.get_document(doc_id)
+	revision = doc[2] if doc else None
+	if(page := pages.get(doc_id)) and page[0] == revision:
+		return page[1]
+	state = {'id': doc_id, 'revision': revision, 'snapshot': None}
+	# big document is not embedded: client renders local copy & revalidates it by revision
+	if doc and len(doc[1]) <= embed_max:
+		state['snapshot'] = doc[0].snapshot()
+	html = templates.get_template('editor.html').render(client_metrics=client_metrics,
+		state=json.dumps(state, separators=(',', ':')).replace('</', '<\\/'))  # state is inside script tag
+	pages.put(doc_id, (revision, html), len(html))
+	return html
+
+
+@app.on_event('shutdown')
+def shutdown():
+	documents.close()  # flush unsaved documents
+	if pool:
+		pool.shutdown(cancel_futures=True)
+
 
 @app.get("/", response_class=HTMLResponse)
-async def root(request: Request):
-	return templates.TemplateResponse('editor.html', {'request': request})
+async def root(doc: str = DEFAULT_DOC_ID):
+	return await edit(doc)
+
+
+@app.get('/edit/{doc_id}', response_class=HTMLResponse)
+async def edit(doc_id: str):
+	check_doc_id(doc_id)
+	return HTMLResponse(await run_in_threadpool(render_editor, doc_id))
+
+
+@app.get('/doc/{doc_id}', response_class=PlainTextResponse)
+async def doc_load(doc_id: str, request: Request):
+	check_doc_id(doc_id)
+	if not (doc := await run_in_threadpool(documents.get_text, doc_id)):
+		raise HTTPException(status_code=404, detail='Document not found')
+	text, revision = doc
+	headers = {'ETag': f'"{revision}"'}
+	if request.headers.get('if-none-match') == headers['ETag']:
+		return Response(status_code=304, headers=headers)  # client copy is up to date
+	return PlainTextResponse(text, headers=headers)
+
+
+@app.put('/doc/{doc_id}')
+async def doc_save(doc_id: str, request: Request):
+	'Saves document. If-Match header with revision of edited document: saved only if document is not changed since'
+	check_doc_id(doc_id)
+	body = await request.body()
+	base = if_match.strip('"') if (if_match := request.headers.get('if-match')) else None
+	try:
+		revision = await run_in_threadpool(documents.put, doc_id, body.decode(), base)
+	except ValueError as e:  # UnicodeDecodeError too
+		raise HTTPException(status_code=400, detail=str(e))
+	except ConflictError:
+		raise HTTPException(status_code=412, detail='Document is changed since edited revision')
+	return {'id': doc_id, 'revision': revision}
+
+
+@app.get('/doc/{doc_id}/export.svg')
+async def doc_export_svg(doc_id: str, request: Request):
+	'Standalone SVG of document'
+	check_doc_id(doc_id)
+	if not (r := await render(doc_id, 'svg')):
+		raise HTTPException(status_code=404, detail='Document not found')
+	return render_response(request, *r)
+
+
+@app.get('/doc/{doc_id}/thumbnail.png')
+async def doc_thumbnail(doc_id: str, request: Request, size: int = THUMBNAIL_SIZE):
+	'PNG thumbnail of document: size x size px'
+	check_doc_id(doc_id)
+	if size not in THUMBNAIL_SIZES:
+		raise HTTPException(status_code=400, detail=f'Thumbnail size range: {THUMBNAIL_SIZES.start}..{THUMBNAIL_SIZES.stop - 1}')
+	if not (r := await render(doc_id, 'png', size)):
+		raise HTTPException(status_code=404, detail='Document not found')
+	return render_response(request, *r)
+
+
+@app.get('/documents')  # /docs is FastAPI API docs
+async def documents_list():
+	'Stored documents with thumbnails URLs'
+	ids = await run_in_threadpool(documents.store.list_ids)
+	return {'documents': [{'id': x, 'edit': f'/edit/{x}', 'thumbnail': f'/doc/{x}/thumbnail.png'} for x in ids]}
+
+
+@app.post('/export')
+async def export(request: Request):
+	'''Renders documents by worker processes pool: {"ids": [doc_id, ...], "format": "svg" | "png", "size": int}
+	Returns {"renders": {doc_id: render URL or null if document not exists}}'''
+	data = await read_json_object(request)
+	ids, format, size = data.get('ids'), data.get('format', 'png'), data.get('size', THUMBNAIL_SIZE)
+	if not isinstance(ids, list) or len(ids) > EXPORT_BATCH_MAX or not all(isinstance(x, str) and DocumentStore.is_valid_id(x) for x in ids):
+		raise HTTPException(status_code=400, detail=f'List of up to {EXPORT_BATCH_MAX} document IDs expected')
+	if not isinstance(format, str) or format not in FORMATS or type(size) is not int or size not in THUMBNAIL_SIZES:
+		raise HTTPException(status_code=400, detail='Invalid format or size')
+	results = await asyncio.gather(*(render(x, format, size) for x in ids))
+	return {'renders': {x: f'/render/{r[0]}' if r else None for x, r in zip(ids, results)}}
+
+
+@app.get('/render/{name}')
+async def render_get(name: str, request: Request):
+	'Cached render by name (content hash)'
+	if not RenderCache.is_valid_name(name) or (data := await run_in_threadpool(renders.get, name)) is None:
+		raise HTTPException(status_code=404, detail='Render not found')
+	return render_response(request, name, data, immutable=True)
+
+
+@app.get('/cache/stats')
+async def cache_stats():
+	return documents.get_stats()
+
+
+@app.post('/metrics/client')
+async def metrics_client(request: Request):
+	'''Editor metrics aggregates:
+	{"histograms": {handler: {"counts": [count per bucket], "sum": ms}}, "gauges": {name: value}}
+	Metrics are checked before update: malformed metrics do not change anything'''
+	if not client_metrics:
+		raise HTTPException(status_code=404, detail='Client metrics are disabled')
+	data = await read_json_object(request)
+	histograms, gauges = [], []
+	try:
+		for handler, h in data.get('histograms', {}).items():
+			if handler in CLIENT_HANDLERS:
+				client_handler_duration.check(h['counts'], h['sum'])
+				histograms.append((handler, h['counts'], h['sum'] / 1000))
+		for name, value in data.get('gauges', {}).items():
+			if(g := client_gauges.get(name)):
+				if type(value) not in (int, float) or not math.isfinite(value):
+					raise ValueError(f'{name}: number expected')
+				gauges.append((g, value))
+	except (AttributeError, KeyError, TypeError, ValueError) as e:
+		raise HTTPException(status_code=400, detail=f'Malformed metrics: {e}')
+	for handler, counts, seconds in histograms:
+		client_handler_duration.merge(counts, seconds, handler=handler)
+	for g, value in gauges:
+		g.set(value)
+	return {}
+
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics_get():
+	'Prometheus metrics of worker process which handles request: samples have pid label'
+	stats = documents.get_stats()
+	for x in ('hits', 'misses', 'evictions', 'saves', 'flushes', 'conflicts'):
+		cache_events.set(stats[x], event=x)
+	for x, g in cache_gauges.items():
+		g.set(stats[x.removesuffix('_bytes')])
+	return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
+@app.post('/import', response_class=StreamingResponse)
+async def import_file(request: Request, format: str):
+	'''Imports SVG or DXF file (request body). Streams imported document text.
+	Malformed file is detected by the first chunk: error in the rest of file aborts response'''
+	if format not in IMPORTERS:
+		raise HTTPException(status_code=400, detail=f'Unsupported format, supported: {", ".join(IMPORTERS)}')
+	# save request body to unnamed file # file is removed on close, even if response is never started
+	f = tempfile.TemporaryFile()
+	try:
+		async for data in request.stream():
+			await run_in_threadpool(f.write, data)
+		if not f.tell():
+			raise HTTPException(status_code=400, detail='Empty file')
+		f.seek(0)
+		chunks = IMPORTERS[format][0](f)
+		first = await run_in_threadpool(next, chunks, None)
+	except ValueError as e:
+		f.close()
+		raise HTTPException(status_code=400, detail=str(e))
+	except BaseException:
+		f.close()
+		raise
+	return StreamingResponse(import_chunks(f, format, chunks, first), media_type='text/plain; charset=utf-8')
@@ -1,2 +1,8 @@
-
+# Usage: ./server_run.sh [prod]
+#   prod - production mode: worker processes pool, count is CPU count (or ODYSSEY_WORKERS)
+if [ "$1" = "prod" ]; then
+	export ODYSSEY_WORKERS="${ODYSSEY_WORKERS:-$(nproc)}"  # server workers split CPUs for their processes pools
+	exec uvicorn server:app --host "${ODYSSEY_HOST:-0.0.0.0}" --port "${ODYSSEY_PORT:-8000}" \
+		--workers "$ODYSSEY_WORKERS" --no-access-log
+fi
 uvicorn server:app --reload
@@ -1,4 +1,6 @@
 
+from __future__ import annotations
+import json
 from base64 import b64encode
 from builtins import property as _property, tuple as _tuple
 from operator import itemgetter as _itemgetter
@@ -7,9 +9,9 @@ from math import copysign, sqrt
 from enum import Enum, auto
 from typing import NamedTuple, Type
 # Brython imports
-from browser import html, document
+from browser import html, document, timer, window
 # Odyssey Web imports
-from bs import create_svg_tag, Pos, ActionBase, Inputbase
+from bs import create_svg_tag, Pos, ActionBase, Inputbase, BackgroundTasks, Metrics, InputRecorder, reduce_points, simplify_points
 
 
 VERSION = (0, 4)
@@ -26,14 +28,68 @@ class OdysseyDrawExample(Inputbase):
 		Notes = auto()
 
 
+	class PointBuffer:
+		'Immutable points. Shared by copies of document objects: copy-on-write'
+
+		__slots__ = ('points', 'bounds', 'svg_points')
+
+		def __init__(self, points: iterable):
+			self.points: tuple[Pos] = tuple(points)
+			self.bounds: tuple[int, int, int, int] | None = None  # (x1, y1, x2, y2) # calculated on first use
+			self.svg_points: str | None = None  # SVG points attribute # created on first use
+
+		def get_bounds(self) -> tuple[int, int, int, int] | None:
+			if self.bounds is None and self.points:
+				xs, ys = [p.x for p in self.points], [p.y for p in self.points]
+				self.bounds = min(xs), min(ys), max(xs), max(ys)
+			return self.bounds
+
+		def get_svg_points(self) -> str:
+			if self.svg_points is None:
+				self.svg_points = ' '.join(repr(p) for p in self.points)
+			return self.svg_points
+
+
 	class Multiline:
+		'Points are buffer points translated by offset. Buffer is replaced on points change, so copies share buffer until changed'
 
 		DEFAULT_WIDTH = 2
 
-		def __init__(self, id: str, layer: OdysseyDrawExample.Layers, closed: bool, points: iterable, width=DEFAULT_WIDTH):
+		def __init__(self, id: str, layer: OdysseyDrawExample.Layers, closed: bool, points: iterable, width=DEFAULT_WIDTH, offset=Pos()):
 			self.id, self.layer = id, layer
 			self.closed, self.width = closed, width
-			self.points: list[Pos] = list(points)
+			self.buffer = points if isinstance(points, OdysseyDrawExample.PointBuffer) else OdysseyDrawExample.PointBuffer(points)
+			self.offset: Pos = offset
+
+		@property
+		def points(self) -> tuple[Pos]:
+			if not self.offset.x and not self.offset.y:
+				return self.buffer.points
+			return tuple(p + self.offset for p in self.buffer.points)
+
+		@points.setter
+		def points(self, points: iterable):
+			self.buffer, self.offset = OdysseyDrawExample.PointBuffer(points), Pos()
+
+		def get_points_count(self) -> int:
+			return len(self.buffer.points)
+
+		def find_point(self, pos: Pos) -> int:
+			'Returns index of point at pos or -1'
+			try:
+				return self.buffer.points.index(pos - self.offset)
+			except ValueError:
+				return -1
+
+		def get_bounds(self) -> tuple[int, int, int, int] | None:
+			'Returns (x1, y1, x2, y2) or None for line without points'
+			if(b := self.buffer.get_bounds()):
+				return b[0] + self.offset.x, b[1] + self.offset.y, b[2] + self.offset.x, b[3] + self.offset.y
+			return None
+
+		def copy(self, id: str, offset=Pos()) -> Multiline:
+			'Returns copy translated by offset. Copy shares points buffer'
+			return type(self)(id, self.layer, self.closed, self.buffer, self.width, self.offset + offset)
 
 		def serialize(self, offset=0) -> str:
 			offset = '\t' * offset
@@ -47,6 +103,19 @@ class OdysseyDrawExample(Inputbase):
 				ret += f'{offset}- {repr(p)}\n'
 			return ret
 
+		def snapshot(self) -> list:
+			'Returns compact JSON compatible state: [id, layer, closed, width, [x0, y0, x1, y1, ...]]'
+			points = []
+			for p in self.points:
+				points.extend(p)
+			return [self.id, self.layer.name, int(self.closed), self.width, points]
+
+		@classmethod
+		def from_snapshot(cls, snapshot: list) -> Multiline:
+			id, layer, closed, width, points = snapshot
+			return cls(id, OdysseyDrawExample.Layers[layer], bool(closed),
+				(Pos(points[i], points[i + 1]) for i in range(0, len(points), 2)), width)
+
 	# UI
 
 	class Style:
@@ -202,7 +271,7 @@ class OdysseyDrawExample(Inputbase):
 		def commit(self):
 			'Document commit for action data'
 			self.action = None
-			print(f'COMMIT\n{OdysseyDrawExample.get_odg().serialize()}')
+			OdysseyDrawExample.get_odg().document_changed()
 
 		def cancel(self):
 			'Document cancel for action data'
@@ -245,6 +314,17 @@ class OdysseyDrawExample(Inputbase):
 			super().__init__()
 			self.tool = tool
 
+		def cleanup_points(self, points: list[Pos], closed: bool) -> list[Pos]:
+			'Commit geometry cleanup if enabled: removes zero-length segments & collinear points, simplifies line by tolerance'
+			odg = OdysseyDrawExample.get_odg()
+			ret = points
+			if odg.geometry_cleanup:
+				ret = reduce_points(points, closed)
+				if odg.simplify_tolerance > 0:
+					ret = simplify_points(ret, odg.simplify_tolerance, closed)
+			odg.on_commit_points(len(ret), len(points) - len(ret))
+			return ret
+
 		@classmethod
 		def title(cls):
 			'Action UI title'
@@ -260,6 +340,7 @@ class OdysseyDrawExample(Inputbase):
 			OdysseyDrawExample.DocumentTool.__init__(self)
 			OdysseyDrawExample.UiBase.__init__(self)
 			self.ref_pos = pars.pos  # reference position for resize
+			self.pos = pars.pos  # current position
 			self.p = None  # selection square SVG tag
 			self.add(pars.pos)
 
@@ -277,6 +358,7 @@ class OdysseyDrawExample(Inputbase):
 
 		def resize(self, pos: Pos):
 			'Resizes UI according to current and reference positions'
+			self.pos = pos
 			p = self.p  # get SVG square tag
 			size = (pos - self.ref_pos).get_with_min(2)
 			# resize square
@@ -301,6 +383,11 @@ class OdysseyDrawExample(Inputbase):
 			self.remove_svg()
 			return ActionBase.Result.Done
 
+		def commit(self):
+			'Selects document lines inside selection square. Document is not changed'
+			self.action = None
+			self.odg().select_rect(self.ref_pos, self.pos)
+
 		@classmethod
 		def title(cls):
 			return 'Select'
@@ -327,19 +414,98 @@ class OdysseyDrawExample(Inputbase):
 			self.root_tag <= t
 
 
+	class Diagnostics:
+		'''Diagnostics panel: document & SVG DOM counters, last handler & commit durations.
+		Orphaned UI tags are #scheme_ui children that are not document objects and not UI in use: leaked tags'''
+
+		REFRESH_INTERVAL = 1000  # ms
+
+		def __init__(self, odg: OdysseyDrawExample):
+			self.odg = odg
+			self.timer = None  # refresh timer if shown
+			self.orphans = 0  # orphaned tags count of last refresh
+			self.orphans_growth = 0  # refreshes with orphaned tags count growth since last decrease
+
+		def toggle(self):
+			if self.timer:
+				timer.clear_interval(self.timer)
+				self.timer = None
+				document['Diagnostics'].style.display = 'none'
+			else:
+				if not self.odg.metrics:
+					self.odg.metrics = Metrics()  # handlers timing
+				self.timer = timer.set_interval(self.refresh, self.REFRESH_INTERVAL)
+				document['Diagnostics'].style.display = 'block'
+				self.refresh()
+
+		def get_orphans(self) -> int:
+			'Returns count of orphaned UI tags'
+			odg = self.odg
+			ids = {x.id for x in odg.document}
+			for ui in (odg.pointer, odg.tool, getattr(odg.tool, 'action', None), getattr(odg.tool, 'point_selection', None)):
+				if isinstance(ui, OdysseyDrawExample.UiBase) and ui.root_tag:
+					ids.add(ui.root_tag.id)
+			return sum(1 for t in document['scheme_ui'].children if t.id not in ids)
+
+		def refresh(self):
+			odg = self.odg
+			orphans = self.get_orphans()
+			self.orphans_growth = self.orphans_growth + 1 if orphans > self.orphans else 0 if orphans < self.orphans else self.orphans_growth
+			if self.orphans_growth == 1:
+				print(f'DIAGNOSTICS: orphaned UI tags: {self.orphans} -> {orphans}')
+			self.orphans = orphans
+			text = f'Objects: {len(odg.document)}, vertices: {sum(x.get_points_count() for x in odg.document)}'
+			text += f' | SVG: {window.document.getElementById("scheme_ui").getElementsByTagName("*").length}'
+			text += f' | Orphans: {orphans}' + (' LEAK' if orphans and self.orphans_growth else '')
+			last = odg.metrics.last if odg.metrics else {}
+			if(handler := next((k for k in reversed(list(last)) if k.startswith('on_')), None)):
+				text += f' | {handler[3:]}: {last[handler]:.1f} ms'
+			if(ms := last.get('commit')) is not None:
+				text += f' | commit: {ms:.1f} ms'
+			tag = document['Diagnostics']
+			tag.text = text
+			if orphans:
+				tag.classList.add('odDiagnosticsLeak')
+			else:
+				tag.classList.remove('odDiagnosticsLeak')
+
+
+	DEFAULT_DOC_ID = 'untitled'
+	GEOMETRY_CLEANUP = True  # remove zero-length segments & collinear points on commit
+	SIMPLIFY_TOLERANCE = 0  # line simplification tolerance on commit, 0 - disabled
+	AUTOSAVE_DELAY = 2000  # ms after last document change
+	ARRAY_SIZE = (10, 10)  # columns, rows of selection array
+	METRICS_INTERVAL = 10000  # ms
+
 	def __init__(self):
 		Inputbase.__init__(self, 'odGraphContainer')
+		self.state = self.get_embedded_state()  # initial document state
+		if(state := self.state):
+			self.doc_id, self.revision = state['id'], state['revision']
+		else:
+			self.doc_id, self.revision = window.URLSearchParams.new(window.location.search).get('doc') or self.DEFAULT_DOC_ID, None
 		self.document = []  # schematic objects
+		self.tasks = BackgroundTasks('odw')  # serialization, parsing & autosave
+		self.autosave_timer = None
+		self.save_task: int | None = None  # save in progress
+		self.save_pending = False  # document changed while save in progress
+		self.synced: dict[str, tuple] = {}  # object ID: (points buffer, offset) sent to background tasks
+		self.sync_reset = True  # background tasks document state is to be replaced
 		self.sheet = self.Sheet().refresh()
 		self.grid = self.Grid().refresh()
 		self.pointer = self.Pointer().add()
 		self.pointer_snap_to_grid = True
+		self.geometry_cleanup, self.simplify_tolerance = self.GEOMETRY_CLEANUP, self.SIMPLIFY_TOLERANCE
+		self.commit_stats: dict | None = None  # last commit vertices stats
+		self.diagnostics = self.Diagnostics(self)
 		self.select = None
+		self.selection: list[OdysseyDrawExample.Multiline] = []  # selected lines
+		self.clipboard: list[OdysseyDrawExample.Multiline] = []  # copies of lines
 		self.tool: DocumentTool | None = None
 
 	def document_add(self, item: object):
 		self.document.append(item)
-		print(f'COMMIT ADD\n{self.serialize()}')
+		self.document_changed()
 
 	def document_get(self, id: str) -> object | None:
 		for i in self.document:
@@ -364,7 +530,7 @@ class OdysseyDrawExample(Inputbase):
 					break
 		else:
 			self.document.remove(id)
-		print(f'COMMIT DEL\n{self.serialize()}')
+		self.document_changed()
 
 	def serialize(self, offset=0) -> str:
 		ret = ''
@@ -372,6 +538,240 @@ class OdysseyDrawExample(Inputbase):
 			ret += '- ' + item.serialize()
 		return ret
 
+	def snapshot(self) -> list:
+		'Returns compact JSON compatible document state. Used by background tasks'
+		return [x.snapshot() for x in self.document]
+
+	def hydrate(self, snapshot: list):
+		'Replaces document with document state'
+		for item in self.document:
+			OdysseyDrawExample.UiBase(item.id).remove_svg()
+		self.document = [self.Multiline.from_snapshot(x) for x in snapshot]
+		self.selection = []
+		self.synced, self.sync_reset = {}, True
+		tool = LineTool()
+		for line in self.document:
+			tool.load_line(line)
+
+	def get_changes(self) -> dict:
+		'''Returns document changes since previous call: {"reset": bool, "changed": [object snapshot, ...], "deleted": [id, ...]}.
+		Snapshots are made for changed objects only: points are changed by points buffer replacement'''
+		synced, self.synced = self.synced, {}
+		changed = []
+		for x in self.document:
+			if not (s := synced.get(x.id)) or s[0] is not x.buffer or s[1] != x.offset:
+				changed.append(x.snapshot())
+			self.synced[x.id] = x.buffer, x.offset
+		ret = {'reset': self.sync_reset, 'changed': changed, 'deleted': [k for k in synced if k not in self.synced]}
+		self.sync_reset = False
+		return ret
+
+	def document_changed(self):
+		'Schedules autosave'
+		if self.autosave_timer:
+			timer.clear_timeout(self.autosave_timer)
+		self.autosave_timer = timer.set_timeout(self.save, self.AUTOSAVE_DELAY)
+		self.on_save_status_changed(False)
+
+	def save(self):
+		'Saves document to server in background'
+		if self.autosave_timer:
+			timer.clear_timeout(self.autosave_timer)
+			self.autosave_timer = None
+		if self.save_task:
+			# save in progress # save again when done
+			self.save_pending = True
+			return
+		self.save_pending = False
+		self.save_task = self.tasks.run('save', self.on_saved, doc_id=self.doc_id, revision=self.revision,
+			changes=self.timed('snapshot', self.get_changes))
+
+	def on_saved(self, msg: dict):
+		self.save_task = None
+		self.revision = msg.get('revision', self.revision)
+		if(m := self.metrics) and (ms := msg.get('serialize_ms')) is not None:
+			m.observe('serialize', ms)
+		if msg.get('conflict'):
+			# document is changed on server since edited revision # local copy is kept until user choice
+			print(msg['error'])
+			self.on_save_conflict(True)
+			if self.save_pending:
+				self.save()  # keep last changes in local copy
+		elif(error := msg.get('error')):
+			print(error)
+			self.document_changed()  # retry
+		elif self.save_pending:
+			self.save()
+		else:
+			self.on_save_conflict(False)
+			self.on_save_status_changed(True)
+
+	def save_over_conflict(self):
+		'Saves document over document changed on server'
+		self.revision = None  # no revision check
+		self.on_save_conflict(False)
+		self.save()
+
+	def load_over_conflict(self):
+		'Discards local changes: loads document changed on server'
+		if self.autosave_timer:
+			timer.clear_timeout(self.autosave_timer)
+			self.autosave_timer = None
+		self.revision = None  # download document
+		self.on_save_conflict(False)
+		self.load()
+
+	def open(self, server_revision: str | None = None, snapshot: list | None = None):
+		'''Opens document: local copy from documents cache is rendered at once, then local copy is revalidated with server in background.
+		server_revision - document revision on server if known: no revalidation request if local copy has the same revision
+		snapshot - document state of server_revision embedded into page: used with no server request, unless local copy is not saved'''
+		self.revision = None  # revision of rendered document # no document yet
+		self.tasks.run('cache_get', lambda msg: self.on_cached(msg, server_revision, snapshot), doc_id=self.doc_id)
+
+	def on_cached(self, msg: dict, server_revision: str | None, snapshot: list | None = None):
+		if(error := msg.get('error')):
+			print(error)
+		if(record := None if error else msg['record']) and record['dirty']:
+			# local changes are not saved to server # save local copy
+			self.revision = record['revision']
+			self.hydrate(record['snapshot'])
+			self.document_changed()
+		elif snapshot is not None:
+			# embedded document state # no load request
+			self.revision = server_revision
+			self.hydrate(snapshot)
+			if not error and (not record or record['revision'] != server_revision):
+				self.tasks.run('cache_put', doc_id=self.doc_id, revision=server_revision, snapshot=snapshot)
+		elif record:
+			self.revision = record['revision']
+			self.hydrate(record['snapshot'])
+			if not self.revision or self.revision != server_revision:
+				self.load()
+		else:
+			self.load()
+
+	def load(self):
+		'Loads document from server in background. Document is downloaded only if changed since current revision'
+		self.tasks.run('load', self.on_loaded, doc_id=self.doc_id, revision=self.revision)
+
+	def on_loaded(self, msg: dict):
+		if(error := msg.get('error')):
+			print(error)  # offline # keep local copy
+		elif msg.get('not_modified'):
+			pass
+		elif(snapshot := msg['snapshot']) is not None:
+			self.revision = msg['revision']
+			self.hydrate(snapshot)
+			self.on_save_status_changed(True)
+
+	def on_commit_points(self, vertices: int, saved: int):
+		'Commit geometry cleanup stats'
+		self.commit_stats = {'vertices': vertices, 'saved': saved}
+		print(f'COMMIT: {vertices} vertices, {saved} vertices saved')
+
+	def enable_metrics(self):
+		'Enables handlers timing & periodic metrics report to server'
+		self.metrics = Metrics()
+		timer.set_interval(self.report_metrics, self.METRICS_INTERVAL)
+
+	def report_metrics(self):
+		if not (histograms := self.metrics.pop_aggregates()):
+			return
+		gauges = {
+			'dom_nodes': window.document.getElementById('SvgContainer').getElementsByTagName('*').length,
+			'document_objects': len(self.document),
+			'document_vertices': sum(x.get_points_count() for x in self.document),
+		}
+		self.tasks.run('metrics', metrics={'histograms': histograms, 'gauges': gauges})
+
+	def toggle_recording(self):
+		'Starts input trace recording or stops recording & downloads trace'
+		if(r := self.recorder):
+			self.recorder = None
+			r.events.pop()  # stop recording key event
+			r.download(f'{self.doc_id}.trace.json')
+		else:
+			self.recorder = InputRecorder()
+
+	def on_save_status_changed(self, saved: bool):
+		document['SaveStatus'].style.display = 'none' if saved else 'inline-block'
+
+	def on_save_conflict(self, conflict: bool):
+		document['SaveConflict'].style.display = 'inline-block' if conflict else 'none'
+
+	# Selection & clipboard
+
+	def select_rect(self, pos1: Pos, pos2: Pos):
+		'Selects document lines inside rectangle'
+		(x1, x2), (y1, y2) = sorted((pos1.x, pos2.x)), sorted((pos1.y, pos2.y))
+		self.set_selection([x for x in self.document_iter(self.Multiline)
+			if (b := x.get_bounds()) and x1 <= b[0] and y1 <= b[1] and b[2] <= x2 and b[3] <= y2])
+
+	def set_selection(self, items: list[Multiline]):
+		for item in self.selection:
+			if(tag := document.getElementById(item.id)):
+				tag.classList.remove('odSelected')
+		self.selection = items
+		for item in items:
+			if(tag := document.getElementById(item.id)):
+				tag.classList.add('odSelected')
+		if not self.tool:
+			self.on_action_changed()
+
+	def get_selection(self) -> list[Multiline]:
+		'Returns selected lines that are still in document'
+		ids = {x.id for x in self.document}
+		return [x for x in self.selection if x.id in ids]
+
+	def copy_selection(self):
+		'Copies selected lines to clipboard. Copies share points with lines'
+		if(items := self.get_selection()):
+			self.clipboard = [x.copy(x.id) for x in items]
+
+	def paste(self, pos: Pos):
+		'Pastes clipboard lines: top left corner of lines bounds is moved to pos'
+		if self.clipboard:
+			x1, y1, _, _ = self.get_bounds(self.clipboard)
+			self.add_copies(self.clipboard, [pos - Pos(x1, y1)])
+
+	def duplicate(self, columns=1, rows=1):
+		'''Duplicates selected lines: array of copies to the right & down of selection with gap of grid cell.
+		1 x 1 array is one copy shifted by grid cell'''
+		if not (items := self.get_selection()):
+			return
+		cell = self.get_cell_size() or 0
+		if columns == rows == 1:
+			offsets = [Pos(cell, cell)]
+		else:
+			x1, y1, x2, y2 = self.get_bounds(items)
+			step = Pos(x2 - x1 + cell, y2 - y1 + cell)
+			offsets = [Pos(step.x * c, step.y * r) for r in range(rows) for c in range(columns) if r or c]
+		self.add_copies(items, offsets)
+
+	def add_copies(self, items: list[Multiline], offsets: list[Pos]):
+		'Adds copies of lines translated by every offset & selects copies. Copies share points & have compact UI'
+		ids = {x.id for x in self.document}
+		copies = []
+		tool = LineTool()
+		for offset in offsets:
+			for item in items:
+				id = 'i' + self.UiBase.new_id()
+				while id in ids:
+					id = 'i' + self.UiBase.new_id()
+				ids.add(id)
+				copies.append(copy := item.copy(id, offset))
+				tool.load_line(copy, True)
+		self.document.extend(copies)
+		self.document_changed()
+		self.set_selection(copies)
+
+	@classmethod
+	def get_bounds(cls, items: list[Multiline]) -> tuple[int, int, int, int]:
+		'Returns bounds of lines: (x1, y1, x2, y2)'
+		if not (bounds := [b for x in items if (b := x.get_bounds())]):
+			return 0, 0, 0, 0
+		return min(b[0] for b in bounds), min(b[1] for b in bounds), max(b[2] for b in bounds), max(b[3] for b in bounds)
+
 	def get_cell_size(self) -> int | None:
 		return self.grid.DEFAULT_PARAMETERS['cell_size']
 
@@ -408,7 +808,7 @@ class OdysseyDrawExample(Inputbase):
 					self.on_tool_changed()
 			case result.Done:
 				if(t := self.tool):
-					t.commit()
+					self.timed('commit', t.commit)
 					self.tool = None
 					self.on_tool_changed()
 
@@ -418,7 +818,7 @@ class OdysseyDrawExample(Inputbase):
 			self.on_action_changed()
 
 	def on_action_changed(self, action: ToolAction | None = None):
-		document['ActionStatus'].innerText = action.title() if action else ''
+		document['ActionStatus'].innerText = action.title() if action else f'Selected: {len(self.selection)}' if self.selection else ''
 
 	# Inputbase
 
@@ -457,13 +857,45 @@ class OdysseyDrawExample(Inputbase):
 			match pars.key:
 				case 'l':
 					odg.start_draw(LineTool, pars)
+				case 'r':
+					odg.toggle_recording()
+				case 'd':
+					odg.diagnostics.toggle()
+				case 'c':
+					odg.copy_selection()
+				case 'v':
+					odg.paste(odg.pointer.pos)
+				case 'D':
+					odg.duplicate()
+				case 'A':
+					odg.duplicate(*odg.ARRAY_SIZE)
+				case 'Escape':
+					odg.set_selection([])
 				case 's':
-					print(odg.serialize())
+					odg.tasks.run('serialize', lambda msg: print(msg['text']), snapshot=odg.snapshot())
 
 	@classmethod
-	def init(cls):
+	def init(cls, metrics=False):
 		global odg
 		odg = OdysseyDrawExample()
+		if metrics:
+			odg.enable_metrics()
+		if window.URLSearchParams.new(window.location.search).get('diagnostics') == '1':
+			odg.diagnostics.toggle()
+		document['SaveStatus'].bind('click', lambda ev: odg.save())
+		document['SaveConflictSave'].bind('click', lambda ev: odg.save_over_conflict())
+		document['SaveConflictLoad'].bind('click', lambda ev: odg.load_over_conflict())
+		# open local copy # document state embedded into page is used unless local copy has unsaved changes
+		# big document is not embedded: local copy is revalidated by embedded revision
+		odg.open(*((state['revision'], state['snapshot']) if (state := odg.state) else ()))
+		odg.state = None
+
+	@classmethod
+	def get_embedded_state(cls) -> dict | None:
+		'Returns document state embedded into page by server: {"id": str, "revision": str | None, "snapshot": list | None}'
+		if(tag := document.getElementById('DocumentState')) and (text := tag.text.strip()):
+			return json.loads(text)
+		return None
 
 	@classmethod
 	def open_file():
@@ -498,8 +930,13 @@ class LineTool(OdysseyDrawExample.DocumentTool):
 
 		def commit(self):
 			if(odg := self.tool.odg()):
-				odg.document_add(
-					OdysseyDrawExample.Multiline(self.root_tag.id, OdysseyDrawExample.Layers.Draw, self.closed, self.tool.svg_points_iter()))
+				points = list(self.tool.svg_points_iter())
+				line = OdysseyDrawExample.Multiline(self.root_tag.id, OdysseyDrawExample.Layers.Draw, self.closed, self.cleanup_points(points, self.closed))
+				odg.document_add(line)
+				if len(line.points) != len(points):
+					# sync UI with reduced points
+					self.remove_svg()
+					self.tool.load_line(line)
 
 		def cancel(self):
 			self.remove_svg()
@@ -566,6 +1003,7 @@ class LineTool(OdysseyDrawExample.DocumentTool):
 
 		def __init__(self, tool: 'LineTool', pars: ActionBase.Parameters, line: OdysseyDrawExample.Multiline):
 			OdysseyDrawExample.ToolAction.__init__(self, tool)
+			tool.expand_line(line)
 			OdysseyDrawExample.UiBase.__init__(self, line.id)
 			self.closed = line.closed  # is closed line # used by commit
 			self.line = line  # document line
@@ -590,7 +1028,11 @@ class LineTool(OdysseyDrawExample.DocumentTool):
 
 		def commit(self):
 			if(points := list(self.tool.svg_points_iter())):
-				self.line.points = points
+				self.line.points = self.cleanup_points(points, self.closed)
+				if len(self.line.points) != len(points):
+					# sync UI with reduced points
+					self.remove_svg()
+					self.tool.load_line(self.line)
 			else:
 				# empty line with no points # delete line from document
 				self.tool.odg().document_del(self.line.id)
@@ -645,6 +1087,7 @@ class LineTool(OdysseyDrawExample.DocumentTool):
 
 		def __init__(self, tool: 'LineTool', pars: ActionBase.Parameters, line: OdysseyDrawExample.Multiline):
 			OdysseyDrawExample.ToolAction.__init__(self, tool)
+			tool.expand_line(line)
 			OdysseyDrawExample.UiBase.__init__(self, line.id)
 			self.closed = line.closed  # is closed line # used by commit
 			self.line = line  # document line
@@ -656,12 +1099,13 @@ class LineTool(OdysseyDrawExample.DocumentTool):
 		def commit(self):
 			# apply transform matrix to line points
 			m = self.root_tag.transform.baseVal.consolidate().matrix
-			self.line.points = []
+			points = []
 			for pos in self.tool.svg_points_iter():
 				p = self.create_svg_point()
 				p.x, p.y = pos
 				p = p.matrixTransform(m)
-				self.line.points.append(Pos(p.x, p.y))
+				points.append(Pos(p.x, p.y))
+			self.line.points = self.cleanup_points(points, self.closed)
 			# sync UI # apply transform matrix to SVG lines
 			self.remove_svg()
 			self.tool.load_line(self.line)
@@ -701,12 +1145,11 @@ class LineTool(OdysseyDrawExample.DocumentTool):
 			# check for document line points under mouse
 			pos = pars.pos
 			for line in self.document_iter(OdysseyDrawExample.Multiline):
-				for i, p in enumerate(line.points):
-					if p == pos:  # is line point under mouse
-						# point under mouse found # show selection point UI
-						self.point_selection = OdysseyDrawExample.PointSelection(pos, i == 0 or i == len(line.points) - 1)
-						self.line = line
-						return
+				if(i := line.find_point(pos)) >= 0:  # is line point under mouse
+					# point under mouse found # show selection point UI
+					self.point_selection = OdysseyDrawExample.PointSelection(pos, i == 0 or i == line.get_points_count() - 1)
+					self.line = line
+					return
 			# no one point under mouse # hide selection point UI
 			if(ps := self.point_selection):
 				ps.remove_svg()
@@ -752,11 +1195,32 @@ class LineTool(OdysseyDrawExample.DocumentTool):
 			if not a.closed and (l := a.get_last_child()):
 				yield Pos(l.attrs['x2'], l.attrs['y2'])
 
-	def load_line(self, line: OdysseyDrawExample.Multiline):
+	def load_line(self, line: OdysseyDrawExample.Multiline, compact=False):
+		'''Adds line UI. Compact UI is one polyline tag translated by line offset: SVG points are shared by copies of line.
+		Compact UI is not editable: see expand_line'''
 		tag = OdysseyDrawExample.UiBase(line.id)  # create UI for line
+		if compact:
+			p = create_svg_tag('polygon' if line.closed else 'polyline')
+			p.attrs['points'] = line.buffer.get_svg_points()
+			p.attrs['fill'] = 'none'
+			p.attrs['stroke'] = self.DEFAULT_COLOR
+			p.attrs['stroke-width'] = line.width
+			tag.root_tag <= p
+			if(o := line.offset).x or o.y:
+				tag.root_tag.attrs['transform'] = f'translate({o.x},{o.y})'
+			return
 		# add lines to UI
 		for pos1, pos2 in zip(line.points[:-1], line.points[1:]):
 			tag.root_tag <= self.create_segment(pos1, pos2, False)
+		if line.closed and len(line.points) > 2:
+			# closing line
+			tag.root_tag <= self.create_segment(line.points[-1], line.points[0], False)
+
+	def expand_line(self, line: OdysseyDrawExample.Multiline):
+		'Replaces compact line UI with editable line UI'
+		if(tag := document.getElementById(line.id)) and (t := tag.firstElementChild) and t.tagName in ('polyline', 'polygon'):
+			OdysseyDrawExample.UiBase(line.id).remove_svg()
+			self.load_line(line)
 
 	def create_segment(cls, pos1: Pos, pos2: Pos, temporary=True) -> object:
 		l = create_svg_tag('line')
@@ -1,9 +1,10 @@
 
+import json
 from builtins import property as _property, tuple as _tuple
 from operator import itemgetter as _itemgetter
 from enum import Enum, auto
 from math import copysign, sqrt
-from browser import html, document
+from browser import html, document, window
 
 
 def create_svg_tag(tag_name: str, classes: str | tuple[str] | None = None, id: str | None = None) -> object:
@@ -66,6 +67,61 @@ class Pos(tuple):
 		return sqrt(self.x * self.x + self.y * self.y)
 
 
+def is_collinear(p1: Pos, p2: Pos, p3: Pos) -> bool:
+	'return True if p2 is on segment p1-p3 direction: p1 -> p2 -> p3 is straight line without turn back'
+	d1, d2 = p2 - p1, p3 - p2
+	return d1.x * d2.y == d1.y * d2.x and d1.x * d2.x + d1.y * d2.y > 0
+
+def reduce_points(points: list[Pos], closed=False) -> list[Pos]:
+	'return points without duplicate consecutive points & collinear points. Line shape is not changed'
+	ret = []
+	for p in points:
+		if ret and p == ret[-1]:
+			continue  # zero-length segment
+		while len(ret) > 1 and is_collinear(ret[-2], ret[-1], p):
+			ret.pop()
+		ret.append(p)
+	if closed:
+		# closing segment: last -> first
+		while len(ret) > 1 and ret[-1] == ret[0]:
+			ret.pop()
+		while len(ret) > 3 and is_collinear(ret[-2], ret[-1], ret[0]):
+			ret.pop()
+		while len(ret) > 3 and is_collinear(ret[-1], ret[0], ret[1]):
+			ret.pop(0)
+	return ret
+
+def simplify_points(points: list[Pos], tolerance: float, closed=False) -> list[Pos]:
+	'return points with removed points that are closer than tolerance to simplified line (Ramer-Douglas-Peucker)'
+	if closed and points:
+		points = points + [points[0]]
+	if len(points) < 3:
+		return points[:-1] if closed else points
+	keep = [False] * len(points)
+	keep[0] = keep[-1] = True
+	ranges = [(0, len(points) - 1)]
+	while ranges:
+		first, last = ranges.pop()
+		p1, d = points[first], points[last] - points[first]
+		d_len = d.get_len()
+		max_dist, max_i = 0., 0
+		for i in range(first + 1, last):
+			v = points[i] - p1
+			dist = abs(d.x * v.y - d.y * v.x) / d_len if d_len else v.get_len()
+			if dist > max_dist:
+				max_dist, max_i = dist, i
+		if max_dist > tolerance:
+			keep[max_i] = True
+			ranges.append((first, max_i))
+			ranges.append((max_i, last))
+	ret = [p for p, k in zip(points, keep) if k]
+	if closed:
+		ret.pop()  # closing point
+		if len(ret) < 3:
+			return points[:-1]  # closed line is collapsed # keep as is
+	return ret
+
+
 class ActionBase:
 
 
@@ -121,6 +177,83 @@ class ActionBase:
 		return self.Result.Cancel
 
 
+class Histogram:
+	'Latency histogram, ms. Buckets are the same as server latency metrics buckets (odyssey_metrics.LATENCY_BUCKETS)'
+
+	BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+	def __init__(self):
+		self.counts = [0] * (len(self.BUCKETS) + 1)  # count per bucket + inf bucket
+		self.sum = 0.
+
+	def observe(self, value: float):
+		i = 0
+		while i < len(self.BUCKETS) and value > self.BUCKETS[i]:
+			i += 1
+		self.counts[i] += 1
+		self.sum += value
+
+
+class Metrics:
+	'Handlers timing: latency histograms since last aggregates'
+
+	def __init__(self):
+		self.histograms: dict[str, Histogram] = {}
+		self.last: dict[str, float] = {}  # handler: last duration, ms # ordered by last call
+
+	def observe(self, name: str, value: float):
+		if not (h := self.histograms.get(name)):
+			h = self.histograms[name] = Histogram()
+		h.observe(value)
+		self.last.pop(name, None)
+		self.last[name] = value
+
+	def timed(self, name: str, func, *args):
+		'Calls func with timing'
+		start = window.performance.now()
+		try:
+			return func(*args)
+		finally:
+			self.observe(name, window.performance.now() - start)
+
+	def pop_aggregates(self) -> dict:
+		'Returns histograms aggregates & starts new histograms'
+		ret = {k: {'counts': v.counts, 'sum': v.sum} for k, v in self.histograms.items()}
+		self.histograms = {}
+		return ret
+
+
+class InputRecorder:
+	'''Input events trace recorder. Trace is replayed by tools/replay.py
+	Trace: {"version": 1, "events": [{"t": ms from start, "type": DOM event type, event fields...}, ...]}'''
+
+	VERSION = 1
+	POINTER_FIELDS = ('offsetX', 'offsetY', 'buttons', 'metaKey', 'altKey', 'shiftKey')
+	KEY_FIELDS = ('key', 'metaKey', 'altKey', 'shiftKey')
+
+	def __init__(self):
+		self.start = window.performance.now()
+		self.events: list[dict] = []
+
+	def record(self, ev):
+		item = {'t': round(window.performance.now() - self.start, 3), 'type': ev.type}
+		for k in self.KEY_FIELDS if ev.type == 'keydown' else self.POINTER_FIELDS:
+			item[k] = getattr(ev, k)
+		self.events.append(item)
+
+	def to_json(self) -> str:
+		return json.dumps({'version': self.VERSION, 'events': self.events})
+
+	def download(self, file_name: str):
+		'Saves trace to file by browser download'
+		blob = window.Blob.new([self.to_json()], {'type': 'application/json'})
+		a = document.createElement('a')
+		a.href = window.URL.createObjectURL(blob)
+		a.download = file_name
+		a.click()
+		window.URL.revokeObjectURL(a.href)
+
+
 class Inputbase:
 
 	def __init__(self, root_tag_id: str) -> None:
@@ -132,28 +265,38 @@ class Inputbase:
 			self.hovered_tag = ev.target
 			if find_parent(ev.target, self.root_tag_id):
 				# pointer move over root tag
+				if(r := self.recorder):
+					r.record(ev)
 				pars = ActionBase.PointerParameters(ev)
 				# print(f'Move {pars=}')
-				self.on_mouse_move(pars)
+				self.timed('on_mouse_move', self.on_mouse_move, pars)
 
 		def pointer_down(ev):
+			if(r := self.recorder):
+				r.record(ev)
 			pars = ActionBase.PointerParameters(ev)
 			# print(f'DOWN {pars=}')
-			self.on_pointer_down(pars)
+			self.timed('on_pointer_down', self.on_pointer_down, pars)
 
 		def pointer_up(ev):
+			if(r := self.recorder):
+				r.record(ev)
 			pars = ActionBase.PointerParameters(ev)
 			# print(f'UP   {pars=}')
-			self.on_pointer_up(pars)
+			self.timed('on_pointer_up', self.on_pointer_up, pars)
 
 		def key_down(ev):
+			if(r := self.recorder):
+				r.record(ev)
 			pars = ActionBase.KeyParameters(ev)
 			# print(f'KEY DOWN: key: {pars.key}')
-			self.on_key_down(pars)
+			self.timed('on_key_down', self.on_key_down, pars)
 			ev.preventDefault()
 			ev.stopPropagation()
 
 		self.root_tag_id = root_tag_id
+		self.metrics: Metrics | None = None  # handlers timing if enabled
+		self.recorder: InputRecorder | None = None  # input trace recording if enabled
 
 		self.hovered_tag = None
 		document.bind('mousemove', mouse_move)
@@ -161,6 +304,12 @@ class Inputbase:
 		document.bind('pointerup', pointer_up)
 		document.bind('keydown', key_down)
 
+	def timed(self, name: str, func, *args):
+		'Calls func with timing if metrics enabled'
+		if(m := self.metrics):
+			return m.timed(name, func, *args)
+		return func(*args)
+
 	def on_mouse_move(self, pars: ActionBase.PointerParameters):
 		pass
 
@@ -172,3 +321,30 @@ class Inputbase:
 
 	def on_key_down(self, pars: ActionBase.KeyParameters):
 		pass
+
+
+class BackgroundTasks:
+	'Web Worker tasks. Worker script tag must have class "webworker" and id'
+
+	def __init__(self, worker_id: str) -> None:
+		from browser import worker
+		self.worker = worker.Worker(worker_id)
+		self.worker.bind('message', self._on_message)
+		self.task = 0  # last task number
+		self.callbacks: dict = {}  # task number: callback
+
+	def run(self, op: str, callback=None, **kwargs) -> int:
+		'Runs worker task; callback(response: dict) is called with task response. Returns task number'
+		self.task += 1
+		if callback:
+			self.callbacks[self.task] = callback
+		kwargs['op'], kwargs['task'] = op, self.task
+		self.worker.send(kwargs)
+		return self.task
+
+	def _on_message(self, ev):
+		msg = ev.data
+		if(callback := self.callbacks.pop(msg['task'], None)):
+			callback(msg)
+		elif(error := msg.get('error')):
+			print(f'Background task error: {error}')
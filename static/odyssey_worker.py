@@ -0,0 +1,213 @@
+'''Odyssey Web background tasks. Runs in Web Worker, so blocking of editor input handling is avoided.
+Request message: {'op': str, 'task': int, ...}
+Response message: {'task': int, ...} or {'task': int, 'error': str}
+Document snapshot is compact JSON compatible document state: [[id, layer, closed, width, [x0, y0, x1, y1, ...]], ...]
+Recently opened documents are cached in IndexedDB: {"revision": str | None, "dirty": bool, "snapshot": [...]} as JSON text by document ID.
+Dirty document is changed locally & not saved to server yet'''
+
+import json
+# Brython imports
+from browser import bind, self as worker, ajax
+
+
+DEFAULT_WIDTH = 2
+# IndexedDB documents cache
+DB_NAME, DB_VERSION = 'odyssey', 1
+DOCUMENTS_STORE = 'documents'  # document ID: document record JSON
+RECENT_STORE = 'recent'  # document ID: last use time, ms
+CACHE_MAX_DOCUMENTS = 20
+db = None  # opened database
+db_waiting: list | None = None  # (callback, error) waiting for database open in progress
+mirrors: dict[str, dict[str, list]] = {}  # document ID: {object ID: object snapshot} # editor document state for saves
+
+
+def serialize(snapshot: list) -> str:
+	'Returns document text of snapshot. Same format as OdysseyDrawExample.serialize'
+	ret = []
+	for id, layer, closed, width, points in snapshot:
+		ret.append(f'- multiline:\n\tid:{id}\n\tlayer:{layer}\n')
+		if closed:
+			ret.append('\tclosed:1\n')
+		if width != DEFAULT_WIDTH:
+			ret.append(f'\twidth:{width}\n')
+		for i in range(0, len(points), 2):
+			ret.append(f'\t- {points[i]},{points[i + 1]}\n')
+	return ''.join(ret)
+
+def parse(text: str) -> list:
+	'Returns document snapshot of document text'
+	ret, item = [], None
+	for line in text.splitlines():
+		if not (line := line.strip()):
+			continue
+		if line == '- multiline:':
+			item = [None, 'Draw', 0, DEFAULT_WIDTH, []]
+			ret.append(item)
+		elif line.startswith('- '):
+			x, y = line[2:].split(',')
+			item[4].extend((int(x), int(y)))
+		else:
+			k, v = line.split(':', 1)
+			match k:
+				case 'id':
+					item[0] = v
+				case 'layer':
+					item[1] = v
+				case 'closed':
+					item[2] = int(v == '1')
+				case 'width':
+					item[3] = int(v)
+	return ret
+
+def doc_url(doc_id: str) -> str:
+	return f'/doc/{doc_id}'
+
+def with_db(callback, error):
+	'Calls callback(db) with opened documents cache database or error(message: str)'
+	global db_waiting
+	if db:
+		return callback(db)
+	if db_waiting is not None:
+		db_waiting.append((callback, error))
+		return
+	def upgrade(ev):
+		req.result.createObjectStore(DOCUMENTS_STORE)
+		req.result.createObjectStore(RECENT_STORE)
+	def complete(message: str | None):
+		global db, db_waiting
+		if not message:
+			db = req.result
+		waiting, db_waiting = db_waiting, None
+		for c, e in waiting:
+			if message:
+				e(message)
+			else:
+				c(db)
+	try:
+		req = worker.indexedDB.open(DB_NAME, DB_VERSION)
+	except Exception as e:
+		return error(f'Documents cache error: {e}')  # IndexedDB is not available
+	db_waiting = [(callback, error)]
+	req.onupgradeneeded = upgrade
+	req.onsuccess = lambda ev: complete(None)
+	req.onerror = lambda ev: complete(f'Documents cache error: {req.error}')
+
+def cache_get(doc_id: str, callback, error):
+	'Calls callback(record: dict | None) with cached document record'
+	def get(db):
+		tx = db.transaction([DOCUMENTS_STORE, RECENT_STORE], 'readwrite')
+		req = tx.objectStore(DOCUMENTS_STORE).get(doc_id)
+		def success(ev):
+			if not req.result:
+				return callback(None)
+			tx.objectStore(RECENT_STORE).put(worker.Date.now(), doc_id)
+			callback(json.loads(req.result))
+		req.onsuccess = success
+		req.onerror = lambda ev: error(f'Documents cache error: {req.error}')
+	with_db(get, error)
+
+def cache_put(doc_id: str, record: dict, error):
+	'Caches document record. Least recently used documents are removed to fit CACHE_MAX_DOCUMENTS'
+	def put(db):
+		tx = db.transaction([DOCUMENTS_STORE, RECENT_STORE], 'readwrite')
+		documents, recent = tx.objectStore(DOCUMENTS_STORE), tx.objectStore(RECENT_STORE)
+		documents.put(json.dumps(record, separators=(',', ':')), doc_id)
+		recent.put(worker.Date.now(), doc_id)
+		keys, times = recent.getAllKeys(), recent.getAll()
+		def evict(ev):
+			for _, key in sorted(zip(times.result, keys.result))[:-CACHE_MAX_DOCUMENTS]:
+				documents.delete(key)
+				recent.delete(key)
+		times.onsuccess = evict
+		tx.onerror = lambda ev: error(f'Documents cache error: {tx.error}')
+	with_db(put, error)
+
+def timed_serialize(snapshot: list) -> tuple[str, float]:
+	'Returns (document text, serialization duration in ms)'
+	start = worker.performance.now()
+	text = serialize(snapshot)
+	return text, worker.performance.now() - start
+
+
+def on_serialize(msg: dict, reply):
+	text, ms = timed_serialize(msg['snapshot'])
+	reply(text=text, serialize_ms=ms)
+
+def on_parse(msg: dict, reply):
+	reply(snapshot=parse(msg['text']))
+
+def on_save(msg: dict, reply):
+	'''Saves document to documents cache & server. Cached document is dirty until saved to server.
+	Message has document changes since previous save only: {"reset": bool, "changed": [object snapshot, ...], "deleted": [id, ...]}
+	Server saves document only if it has the revision of message (edited revision): conflict is replied otherwise'''
+	def complete(req):
+		if req.status == 200:
+			revision = json.loads(req.text)['revision']
+			cache_put(doc_id, {'revision': revision, 'dirty': False, 'snapshot': snapshot}, print)
+			reply(revision=revision, serialize_ms=ms)
+		elif req.status == 412:
+			reply(conflict=True, error='Save conflict: document is changed on server')  # cached document stays dirty
+		else:
+			reply(error=f'Save error: {req.status} {req.text}')
+	doc_id, changes = msg['doc_id'], msg['changes']
+	if changes['reset'] or doc_id not in mirrors:
+		mirrors[doc_id] = {}
+	mirror = mirrors[doc_id]
+	for item in changes['changed']:
+		mirror[item[0]] = item
+	for id in changes['deleted']:
+		mirror.pop(id, None)
+	snapshot = list(mirror.values())
+	cache_put(doc_id, {'revision': msg.get('revision'), 'dirty': True, 'snapshot': snapshot}, print)
+	text, ms = timed_serialize(snapshot)
+	headers = {'Content-Type': 'text/plain; charset=utf-8'}
+	if(revision := msg.get('revision')):
+		headers['If-Match'] = f'"{revision}"'
+	ajax.put(doc_url(msg['doc_id']), data=text, headers=headers, oncomplete=complete)
+
+def on_load(msg: dict, reply):
+	'''Loads document snapshot from server & caches it. Snapshot is None if document not exists.
+	If revision of local copy is specified, document is downloaded only if changed: not_modified is replied otherwise'''
+	def complete(req):
+		if req.status == 200:
+			snapshot, revision = parse(req.text), req.getResponseHeader('ETag').strip('"')
+			cache_put(doc_id, {'revision': revision, 'dirty': False, 'snapshot': snapshot}, print)
+			reply(snapshot=snapshot, revision=revision)
+		elif req.status == 304:
+			reply(not_modified=True)
+		elif req.status == 404:
+			reply(snapshot=None)
+		else:
+			reply(error=f'Load error: {req.status} {req.text}')
+	doc_id = msg['doc_id']
+	headers = {'If-None-Match': f'"{revision}"'} if(revision := msg.get('revision')) else {}
+	ajax.get(doc_url(doc_id), headers=headers, cache=True, oncomplete=complete)
+
+def on_cache_get(msg: dict, reply):
+	'Replies cached document record or None'
+	cache_get(msg['doc_id'], lambda record: reply(record=record), lambda error: reply(error=error))
+
+def on_cache_put(msg: dict, reply):
+	'Caches document saved on server'
+	cache_put(msg['doc_id'], {'revision': msg['revision'], 'dirty': False, 'snapshot': msg['snapshot']}, print)
+
+
+def on_metrics(msg: dict, reply):
+	'Posts editor metrics to server'
+	ajax.post('/metrics/client', data=json.dumps(msg['metrics']), headers={'Content-Type': 'application/json'})
+
+
+OPS = {'serialize': on_serialize, 'parse': on_parse, 'save': on_save, 'load': on_load, 'metrics': on_metrics,
+	'cache_get': on_cache_get, 'cache_put': on_cache_put}
+
+
+@bind(worker, 'message')
+def message(ev):
+	msg = ev.data
+	def reply(**kwargs):
+		kwargs['task'] = msg['task']
+		worker.send(kwargs)
+	try:
+		OPS[msg['op']](msg, reply)
+	except Exception as e:
+		reply(error=f'{type(e).__name__}: {e}')
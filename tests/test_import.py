@@ -0,0 +1,72 @@
+import io
+
+import pytest
+from odyssey_document import Document
+from odyssey_import import convert_dxf, convert_svg, parse_path, scan_dxf, scan_svg
+
+SVG = b'''<svg xmlns="http://www.w3.org/2000/svg" xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape">
+<g inkscape:label="Electric" transform="translate(10,20)">
+	<defs><g id="Notes"><rect x="0" y="0" width="9" height="9"/></g></defs>
+	<rect x="0" y="0" width="4" height="2"/>
+	<g id="Notes"><line x1="0" y1="0" x2="5" y2="5"/></g>
+</g>
+<polyline points="1,1 2,2 3,1"/>
+<path d="M0 0 L10 0 L10 10 Z"/>
+<circle cx="0" cy="0" r="10"/>
+<defs>
+	<clipPath id="clip"><rect x="0" y="0" width="100" height="100"/></clipPath>
+	<marker id="arrow"><path d="M0 0 L5 5"/></marker>
+</defs>
+<mask id="mask"><g><rect x="0" y="0" width="50" height="50"/></g></mask>
+</svg>'''
+
+DXF = '''0\nSECTION\n2\nHEADER\n0\nENDSEC\n0\nSECTION\n2\nENTITIES
+0\nLINE\n8\nElectric\n10\n1.0\n20\n2.0\n11\n3.0\n21\n4.0
+0\nLWPOLYLINE\n8\nUnknown\n70\n1\n10\n0\n20\n0\n10\n5\n20\n0\n10\n5\n20\n5
+0\nPOLYLINE\n8\nNotes\n0\nVERTEX\n10\n1\n20\n1\n0\nVERTEX\n10\n2\n20\n2\n0\nSEQEND
+0\nENDSEC\n0\nEOF\n'''.encode()
+
+
+def import_document(scan, convert, data: bytes, **kwargs) -> list:
+	text = ''.join(convert(x) for x in scan(io.BytesIO(data), **kwargs))
+	return [(x.layer.name, x.closed, x.points) for x in Document.parse(text)]
+
+def test_svg():
+	items = import_document(scan_svg, convert_svg, SVG, chunk_size=2)
+	assert items[:4] == [
+		('Electric', True, ((10, 20), (14, 20), (14, 22), (10, 22))),  # group transform
+		('Notes', False, ((10, 20), (15, 25))),  # nested group layer & parent transform
+		('Draw', False, ((1, 1), (2, 2), (3, 1))),
+		('Draw', True, ((0, 0), (10, 0), (10, 10)))]
+	assert len(items) == 5  # shapes of not rendered containers are not imported
+	layer, closed, points = items[4]  # circle is approximated by lines
+	assert (layer, closed) == ('Draw', True) and len(points) > 8
+	assert all(abs((x * x + y * y) ** 0.5 - 10) < 1 for x, y in points)
+
+def test_svg_chunks():
+	chunks = list(scan_svg(io.BytesIO(SVG), chunk_size=2))
+	assert [len(x) for x in chunks] == [2, 2, 1]
+	assert [x[0] for x in chunks[0]] == ['rect', 'line']
+
+def test_path_close_arguments():
+	'Numbers after Z (command without arguments) end path parsing'
+	assert parse_path('M 0 0 L 10 10 Z 5 5 L 1 1') == [(True, [(0., 0.), (10., 10.)])]
+	assert parse_path('M0 0 L1 1 z M 2 2 L 3 3 Z') == [(True, [(0., 0.), (1., 1.)]), (True, [(2., 2.), (3., 3.)])]
+
+def test_svg_malformed():
+	with pytest.raises(ValueError, match='Malformed SVG'):
+		list(scan_svg(io.BytesIO(b'<svg xmlns="http://www.w3.org/2000/svg"><rect')))
+
+def test_dxf():
+	assert import_document(scan_dxf, convert_dxf, DXF) == [
+		('Electric', False, ((1, 2), (3, 4))),
+		('Draw', True, ((0, 0), (5, 0), (5, 5))),  # unknown layer
+		('Notes', False, ((1, 1), (2, 2)))]
+
+def test_dxf_path(tmp_path):
+	(path := tmp_path / 'test.dxf').write_bytes(DXF)
+	assert sum(len(x) for x in scan_dxf(str(path))) == 3
+
+def test_dxf_malformed():
+	with pytest.raises(ValueError, match='Malformed DXF'):
+		list(scan_dxf(io.BytesIO(b'not a DXF file\n')))
@@ -0,0 +1,42 @@
+import pytest
+from odyssey_metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_histogram_text():
+	registry = Registry(pid=12)
+	h = registry.add(Histogram('odyssey_test_seconds', 'Test latency', (0.1, 1.)))
+	h.observe(0.05, handler='a')
+	h.observe(0.5, handler='a')
+	h.observe(2, handler='a')
+	assert registry.render() == (
+		'# HELP odyssey_test_seconds Test latency\n'
+		'# TYPE odyssey_test_seconds histogram\n'
+		'odyssey_test_seconds_bucket{pid="12",handler="a",le="0.1"} 1\n'
+		'odyssey_test_seconds_bucket{pid="12",handler="a",le="1.0"} 2\n'
+		'odyssey_test_seconds_bucket{pid="12",handler="a",le="+Inf"} 3\n'
+		'odyssey_test_seconds_sum{pid="12",handler="a"} 2.55\n'
+		'odyssey_test_seconds_count{pid="12",handler="a"} 3\n')
+
+def test_histogram_merge():
+	h = Histogram('odyssey_test_seconds', 'Test latency', (0.1, 1.))
+	h.merge([1, 0, 2], 3.5, handler='a')
+	h.merge([1, 1, 0], 0.5, handler='a')
+	assert h.values[(('handler', 'a'),)] == [[2, 1, 2], 4.]
+	for counts, sum in (([1, 2], 1.), ([1, -1, 0], 1.), ([1, 0.5, 0], 1.), ([1, 0, 0], -1.), ([1, 0, 0], float('nan'))):
+		with pytest.raises(ValueError):
+			h.merge(counts, sum, handler='a')
+	assert h.values[(('handler', 'a'),)] == [[2, 1, 2], 4.]  # invalid aggregate is not merged
+
+def test_gauge_counter_text():
+	registry = Registry()
+	g = registry.add(Gauge('odyssey_test_entries', 'Test entries'))
+	c = registry.add(Counter('odyssey_test_events_total', 'Test events'))
+	g.set(2.5)
+	c.set(3, event='hits')
+	assert registry.render() == (
+		'# HELP odyssey_test_entries Test entries\n'
+		'# TYPE odyssey_test_entries gauge\n'
+		'odyssey_test_entries 2.5\n'
+		'# HELP odyssey_test_events_total Test events\n'
+		'# TYPE odyssey_test_events_total counter\n'
+		'odyssey_test_events_total{event="hits"} 3\n')
@@ -0,0 +1,103 @@
+import os
+import struct
+import zlib
+from xml.etree.ElementTree import fromstring
+
+from odyssey_document import Document, Layers, Multiline
+from odyssey_render import LAYER_STYLES, MARGIN, RenderCache, draw_line, encode_png, render_png, render_svg
+
+SVG_NS = '{http://www.w3.org/2000/svg}'
+RED = b'\xff\x00\x00\xff'
+
+
+def decode_png(data: bytes) -> tuple[int, int, bytes]:
+	'Returns (width, height, RGBA pixels) of PNG made by encode_png'
+	assert data[:8] == b'\x89PNG\r\n\x1a\n'
+	pos, chunks = 8, {}
+	while pos < len(data):
+		length, = struct.unpack('>I', data[pos:pos + 4])
+		kind, body = data[pos + 4:pos + 8], data[pos + 8:pos + 8 + length]
+		assert struct.unpack('>I', data[pos + 8 + length:pos + 12 + length])[0] == zlib.crc32(kind + body)
+		chunks[kind] = body
+		pos += 12 + length
+	width, height, depth, color_type, _, _, _ = struct.unpack('>IIBBBBB', chunks[b'IHDR'])
+	assert (depth, color_type) == (8, 6) and b'IEND' in chunks
+	raw, stride = zlib.decompress(chunks[b'IDAT']), width * 4
+	assert all(raw[y * (stride + 1)] == 0 for y in range(height))  # filter type 0
+	return width, height, b''.join(raw[y * (stride + 1) + 1:(y + 1) * (stride + 1)] for y in range(height))
+
+def get_pixels(pixels: bytes, size: int, color: bytes) -> set[tuple[int, int]]:
+	'Returns coordinates of pixels of color'
+	return {(i // 4 % size, i // 4 // size) for i in range(0, len(pixels), 4) if pixels[i:i + 4] == color}
+
+def make_document(*items) -> Document:
+	'Returns document of (id, layer, closed, points) items'
+	return Document(Multiline(id, layer, closed, points) for id, layer, closed, points in items)
+
+
+def test_encode_png():
+	pixels = bytearray(3 * 2 * 4)
+	pixels[4:8] = RED
+	assert decode_png(encode_png(pixels, 3, 2)) == (3, 2, bytes(pixels))
+
+def test_draw_line():
+	pixels = bytearray(8 * 8 * 4)
+	draw_line(pixels, 8, (1, 1), (5, 3), RED)
+	assert get_pixels(pixels, 8, RED) == {(1, 1), (2, 2), (3, 2), (4, 3), (5, 3)}
+	pixels = bytearray(8 * 8 * 4)
+	draw_line(pixels, 8, (2, 6), (2, 4), RED)  # reverse direction, vertical
+	assert get_pixels(pixels, 8, RED) == {(2, 4), (2, 5), (2, 6)}
+
+def test_draw_line_clipping():
+	'Pixels outside of image are not drawn'
+	pixels = bytearray(4 * 4 * 4)
+	draw_line(pixels, 4, (-3, 1), (6, 1), RED)
+	assert len(pixels) == 4 * 4 * 4
+	assert get_pixels(pixels, 4, RED) == {(0, 1), (1, 1), (2, 1), (3, 1)}
+	pixels = bytearray(4 * 4 * 4)
+	draw_line(pixels, 4, (-5, -5), (-1, 9), RED)
+	assert not any(pixels)
+
+def test_render_png():
+	doc = make_document(('a', Layers.Electric, False, [(0, 0), (100, 0)]), ('b', Layers.Notes, True, [(0, 50), (100, 50), (50, 100)]))
+	width, height, pixels = decode_png(render_png(doc, 64))
+	assert (width, height) == (64, 64)
+	electric = get_pixels(pixels, 64, bytes(LAYER_STYLES[Layers.Electric]['stroke']) + b'\xff')
+	notes = get_pixels(pixels, 64, bytes(LAYER_STYLES[Layers.Notes]['stroke']) + b'\xff')
+	assert len({y for _, y in electric}) == 1 and len(electric) > 50  # horizontal line across thumbnail
+	assert len({y for _, y in notes}) > 20  # closed triangle
+	assert not set(pixels[3::4]) - {0, 255}  # transparent background
+	assert not any(decode_png(render_png(Document(), 16))[2])  # empty document
+
+def test_render_svg():
+	doc = make_document(('a', Layers.Electric, False, [(0, 0), (100, 20)]), ('b', Layers.Draw, True, [(0, 0), (10, 0), (10, 10)]))
+	svg = fromstring(render_svg(doc))
+	assert svg.get('viewBox') == f'{-MARGIN} {-MARGIN} {100 + 2 * MARGIN} {20 + 2 * MARGIN}'
+	groups = {x.get('id'): x for x in svg.iter(SVG_NS + 'g')}
+	assert list(groups) == ['Electric', 'Draw']  # layers order
+	line, = groups['Electric']
+	assert (line.tag, line.get('id'), line.get('points')) == (SVG_NS + 'polyline', 'a', '0,0 100,20')
+	polygon, = groups['Draw']
+	assert (polygon.tag, polygon.get('stroke-width')) == (SVG_NS + 'polygon', str(Multiline.DEFAULT_WIDTH))
+	assert fromstring(render_svg(Document())).get('viewBox') == f'{-MARGIN} {-MARGIN} {2 * MARGIN} {2 * MARGIN}'
+
+def test_render_cache_name():
+	name = RenderCache.get_name('text', 'png', 64)
+	assert RenderCache.is_valid_name(name) and name.endswith('.png')
+	assert name == RenderCache.get_name('text', 'png', 64)
+	assert len({name, RenderCache.get_name('text', 'png', 32), RenderCache.get_name('text2', 'png', 64),
+		RenderCache.get_name('text', 'svg')}) == 4
+	assert not RenderCache.is_valid_name('../' + name)
+
+def test_render_cache_eviction(tmp_path):
+	'Least recently used renders are removed to fit 90% of budget'
+	cache = RenderCache(str(tmp_path), budget=250)
+	names = [RenderCache.get_name(x, 'svg') for x in 'abc']
+	cache.put(names[0], b'a' * 100)
+	cache.put(names[1], b'b' * 100)
+	for i, name in enumerate(names[:2]):
+		os.utime(os.path.join(tmp_path, name), (1000 + i, 1000 + i))
+	assert cache.get(names[0]) == b'a' * 100  # recently used now
+	cache.put(names[2], b'c' * 100)
+	assert [cache.get(x) is not None for x in names] == [True, False, True]
+	assert cache.size == 200 == RenderCache(str(tmp_path)).size
@@ -0,0 +1,206 @@
+import json
+from time import monotonic, sleep
+
+import pytest
+from odyssey_document import Document, Layers, Multiline
+from odyssey_storage import ConflictError, DocumentCache, DocumentStore, JournalStore
+
+
+def make_document(*items) -> Document:
+	'Returns document of (id, points) items'
+	return Document(Multiline(id, Layers.Draw, False, points) for id, points in items)
+
+def read_journal(store: JournalStore, doc_id: str) -> list:
+	with open(store.get_journal_path(doc_id), 'rb') as f:
+		return [json.loads(x) for x in f.read().splitlines()]
+
+@pytest.fixture
+def store(tmp_path):
+	store = JournalStore(str(tmp_path), sync_interval=0)
+	yield store
+	store.close()
+
+
+def test_diff_apply():
+	base = make_document(('a', [(0, 0), (1, 1)]), ('b', [(2, 2), (3, 3)]), ('c', [(4, 4), (5, 5)]))
+	doc = make_document(('a', [(0, 0), (1, 1)]), ('b', [(2, 2), (9, 9)]), ('d', [(6, 6), (7, 7)]))
+	ops = doc.diff(base)
+	assert sorted(x[0] for x in ops) == ['add', 'delete', 'replace']
+	base.apply(ops)
+	assert base.serialize() == doc.serialize()
+	base.apply(ops)  # replay does not change document
+	assert base.serialize() == doc.serialize()
+	assert doc.diff(base) == []
+	with pytest.raises(ValueError):
+		base.apply([['move', 'a']])
+
+def test_journal_diff(store):
+	doc1 = make_document(('a', [(0, 0), (1, 1)]), ('b', [(2, 2), (3, 3)]))
+	doc2 = make_document(('a', [(0, 0), (1, 1)]), ('b', [(2, 2), (4, 4)]))
+	revision = store.save('doc', doc1.serialize())
+	store.save('doc', doc2.serialize(), doc2, (doc1, revision))
+	assert read_journal(store, 'doc')[1] == [['replace', ['b', 'Draw', 0, 2, [2, 2, 4, 4]]]]
+	assert store.load('doc')[0] == doc2.serialize()
+
+def test_journal_foreign_base(store, tmp_path):
+	doc1 = make_document(('a', [(0, 0), (1, 1)]))
+	doc2 = make_document(('b', [(2, 2), (3, 3)]))
+	doc3 = make_document(('a', [(0, 0), (1, 1)]), ('c', [(4, 4), (5, 5)]))
+	revision = store.save('doc', doc1.serialize())
+	other = JournalStore(str(tmp_path), sync_interval=0)  # another worker process
+	other.save('doc', doc2.serialize())
+	other.close()
+	# base is not the current revision: document is written in full
+	store.save('doc', doc3.serialize(), doc3, (doc1, revision))
+	assert read_journal(store, 'doc')[-1][0] == ['clear']
+	assert store.load('doc')[0] == doc3.serialize()
+
+def test_journal_torn_line(store):
+	doc1 = make_document(('a', [(0, 0), (1, 1)]))
+	doc2 = make_document(('a', [(0, 0), (1, 1)]), ('b', [(2, 2), (3, 3)]))
+	revision = store.save('doc', doc1.serialize())
+	with open(store.get_journal_path('doc'), 'ab') as f:
+		f.write(b'[["add",["b","Dr')  # crashed save
+	assert store.load('doc')[0] == doc1.serialize()
+	revision = store.revision('doc')
+	store.save('doc', doc2.serialize(), doc2, (doc1, revision))
+	assert len(read_journal(store, 'doc')) == 2  # torn line is cut
+	assert store.load('doc')[0] == doc2.serialize()
+
+def test_journal_compaction_crash(store):
+	'Crash after snapshot write, before journal truncation: journal is replayed over new snapshot'
+	doc1 = make_document(('a', [(0, 0), (1, 1)]), ('b', [(2, 2), (3, 3)]))
+	doc2 = make_document(('b', [(2, 2), (3, 3)]), ('c', [(4, 4), (5, 5)]))
+	revision = store.save('doc', doc1.serialize())
+	store.save('doc', doc2.serialize(), doc2, (doc1, revision))
+	DocumentStore.save(store, 'doc', store.load('doc')[0])  # compaction snapshot write
+	assert store.load('doc')[0] == doc2.serialize()
+	store.compact('doc')
+	with open(store.get_journal_path('doc'), 'rb') as f:
+		assert f.read() == b''
+	assert store.load('doc')[0] == doc2.serialize()
+
+def test_journal_save_after_compaction(store):
+	doc1 = make_document(('a', [(0, 0), (1, 1)]))
+	doc2 = make_document(('a', [(0, 0), (2, 2)]))
+	revision = store.save('doc', doc1.serialize())
+	store.compact('doc')
+	# compaction does not change document: base revision before compaction is still valid
+	store.save('doc', doc2.serialize(), doc2, (doc1, revision))
+	assert read_journal(store, 'doc') == [[['replace', ['a', 'Draw', 0, 2, [0, 0, 2, 2]]]]]
+	assert store.load('doc')[0] == doc2.serialize()
+
+def test_cache_revision(store, tmp_path):
+	'Document revision is content hash: not changed by flush & the same after restart'
+	text = make_document(('a', [(0, 0), (1, 1)])).serialize()
+	cache = DocumentCache(store, flush_delay=1000)
+	revision = cache.put('doc', text)
+	assert cache.get_text('doc') == (text, revision)
+	cache.close()
+	restarted = DocumentCache(JournalStore(str(tmp_path), sync_interval=0), flush_delay=0)
+	assert restarted.get_text('doc') == (text, revision)
+	assert restarted.put('doc', text) == revision
+	restarted.close()
+
+def test_cache_workers(store, tmp_path):
+	'Write-through caches of two workers on one directory: the last save wins & is seen by the other worker'
+	texts = [make_document((id, [(0, 0), (1, 1)])).serialize() for id in ('a', 'b', 'c')]
+	other_store = JournalStore(str(tmp_path), sync_interval=0)
+	a, b = DocumentCache(store, flush_delay=0), DocumentCache(other_store, flush_delay=0)
+	a.put('doc', texts[0])
+	revision = b.put('doc', texts[1])
+	assert a.get_text('doc') == (texts[1], revision)
+	b.put('doc', texts[0])
+	revision = a.put('doc', texts[2])  # base of worker a is stale: document is written in full
+	assert b.get_text('doc') == (texts[2], revision)
+	assert store.load('doc')[0] == texts[2]
+	other_store.close()
+
+def test_cache_conflict(store, tmp_path):
+	'Save with revision of edited document is refused if document is changed since by another worker'
+	texts = [make_document((id, [(0, 0), (1, 1)])).serialize() for id in ('a', 'b', 'c')]
+	other_store = JournalStore(str(tmp_path), sync_interval=0)
+	a, b = DocumentCache(store, flush_delay=0), DocumentCache(other_store, flush_delay=0)
+	with pytest.raises(ConflictError):
+		a.put('doc', texts[0], 'revision')  # document not exists
+	assert not store.list_ids()
+	edited = a.put('doc', texts[0])
+	revision = b.put('doc', texts[1], edited)
+	with pytest.raises(ConflictError):
+		a.put('doc', texts[2], edited)
+	assert b.get_text('doc') == (texts[1], revision)
+	assert a.put('doc', texts[2], revision) != revision
+	assert a.get_stats()['conflicts'] == 2
+	other_store.close()
+
+def test_journal_conflict(store):
+	doc = make_document(('a', [(0, 0), (1, 1)]))
+	revision = store.save('doc', doc.serialize())
+	with pytest.raises(ConflictError):
+		store.save('doc', doc.serialize(), expected='revision')
+	assert store.revision('doc') == revision
+	assert store.save('doc', doc.serialize(), expected=revision)
+
+def test_cache_eviction(store):
+	'Least recently used entries are evicted to fit budget'
+	texts = {id: make_document((id, [(0, 0), (1, 1)])).serialize() for id in ('a', 'b', 'c')}
+	cache = DocumentCache(store, flush_delay=0)
+	cache.put('a', texts['a'])
+	cache.budget = cache.size * 2  # two documents
+	cache.put('b', texts['b'])
+	cache.get('a')
+	cache.put('c', texts['c'])
+	assert list(cache.entries) == ['a', 'c'] and cache.get_stats()['evictions'] == 1
+	assert cache.get_text('b')[0] == texts['b']  # reloaded from store
+	assert cache.get_stats()['misses'] == 1
+
+def test_cache_flush_before_eviction(store):
+	'Dirty entry is written to store before eviction'
+	texts = {id: make_document((id, [(0, 0), (1, 1)])).serialize() for id in ('a', 'b')}
+	cache = DocumentCache(store, flush_delay=1000)
+	cache.put('a', texts['a'])
+	cache.budget = cache.size
+	assert store.revision('a') is None  # not flushed yet
+	cache.put('b', texts['b'])
+	assert list(cache.entries) == ['b'] and store.load('a')[0] == texts['a']
+	assert store.revision('b') is None
+	cache.close()
+	assert store.load('b')[0] == texts['b']  # flushed on close
+
+def test_cache_debounce(store):
+	'Saves are coalesced into one write after flush delay without saves'
+	cache = DocumentCache(store, flush_delay=0.05)
+	for i in range(1, 6):
+		cache.put('doc', make_document(('a', [(0, 0), (i, i)])).serialize())
+	assert store.revision('doc') is None
+	deadline = monotonic() + 5
+	while not cache.get_stats()['flushes'] and monotonic() < deadline:
+		sleep(0.01)
+	assert cache.get_stats()['flushes'] == 1 and store.stats['appends'] == 1
+	assert store.load('doc')[0] == make_document(('a', [(0, 0), (5, 5)])).serialize()
+	assert cache.get_stats()['dirty'] == 0
+	cache.close()
+
+def test_cache_save_while_flushing(tmp_path):
+	'Save during flush stays dirty: the next flush writes changes since the flushed document'
+	class Store(JournalStore):
+		on_save = None
+		def save(self, *args, **kwargs):
+			if(on_save := self.on_save):
+				self.on_save = None
+				on_save()
+			return super().save(*args, **kwargs)
+	docs = [make_document(('a', [(0, 0), (1, 1)]), ('b', [(0, 0), (i, i)])) for i in range(1, 4)]
+	store = Store(str(tmp_path), sync_interval=0)
+	cache = DocumentCache(store, flush_delay=1000)
+	cache.put('doc', docs[0].serialize())
+	cache.flush()
+	cache.put('doc', docs[1].serialize())
+	store.on_save = lambda: cache.put('doc', docs[2].serialize())
+	cache.flush()  # writes docs[1], docs[2] is saved while writing
+	assert store.load('doc')[0] == docs[1].serialize() and cache.get_stats()['dirty'] == 1
+	assert cache.get_text('doc')[0] == docs[2].serialize()
+	cache.flush()
+	assert read_journal(store, 'doc')[-1] == [['replace', ['b', 'Draw', 0, 2, [0, 0, 3, 3]]]]  # diff, not full write
+	assert store.load('doc')[0] == docs[2].serialize() and cache.get_stats()['dirty'] == 0
+	cache.close()
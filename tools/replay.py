@@ -0,0 +1,362 @@
+'''Odyssey Web input trace replay: runs editor (static/odyssey_test.py) under CPython with stub browser module.
+Measures editor handlers latency per input event & reports final document state.
+Trace is recorded by editor: press `r` to start recording, `r` again to stop & download trace.
+
+Usage: python tools/replay.py TRACE [--repeat N] [--seed N] [--json]'''
+
+import argparse
+import json
+import os
+import random
+import sys
+from statistics import mean, median
+from time import perf_counter
+from types import ModuleType, SimpleNamespace
+
+
+STATIC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'static')
+ROOT_TAG_CLASS = 'odGraphContainer'  # Inputbase root tag
+# editor page tags used by editor
+PAGE_TAGS = ('PointerCoord', 'GridStatus', 'SheetStatus', 'ToolStatus', 'ActionStatus', 'SaveStatus', 'SaveConflict', 'SaveConflictSave', 'SaveConflictLoad',
+	'Background', 'Diagnostics')
+
+
+# Stub browser module: DOM subset used by editor
+
+class Matrix:
+
+	def __init__(self, e=0., f=0.):
+		self.a, self.b, self.c, self.d, self.e, self.f = 1., 0., 0., 1., e, f
+
+
+class Transform:
+
+	def __init__(self):
+		self.matrix = Matrix()
+
+	def setTranslate(self, x, y):
+		self.matrix = Matrix(x, y)
+
+
+class TransformList(list):
+
+	def appendItem(self, item: Transform):
+		self.append(item)
+
+	def getItem(self, i: int) -> Transform:
+		return self[i]
+
+	def consolidate(self) -> Transform:
+		ret = Transform()
+		for t in self:
+			ret.matrix = Matrix(ret.matrix.e + t.matrix.e, ret.matrix.f + t.matrix.f)
+		return ret
+
+
+class Point:
+
+	def __init__(self):
+		self.x = self.y = 0.
+
+	def matrixTransform(self, m: Matrix) -> 'Point':
+		ret = Point()
+		ret.x = self.x * m.a + self.y * m.c + m.e
+		ret.y = self.x * m.b + self.y * m.d + m.f
+		return ret
+
+
+class ClassList(set):
+
+	def contains(self, name: str) -> bool:
+		return name in self
+
+	def remove(self, name: str):
+		self.discard(name)
+
+
+class NodeList(list):
+
+	@property
+	def length(self) -> int:
+		return len(self)
+
+
+class Attrs(dict):
+	'Element attributes: values are strings like DOM attributes'
+
+	def __init__(self, element: 'Element'):
+		super().__init__()
+		self.element = element
+
+	def __setitem__(self, k, v):
+		super().__setitem__(k, str(v))
+		if k == 'id':
+			self.element.document.ids[str(v)] = self.element
+
+
+class Element:
+
+	def __init__(self, document: 'Document', tag_name: str):
+		self.document, self.tagName = document, tag_name
+		self.attrs = Attrs(self)
+		self.classList = ClassList()
+		self.style = SimpleNamespace()
+		self.children: list[Element] = []
+		self.parentElement: Element | None = None
+		self.transform = SimpleNamespace(baseVal=TransformList())
+		self.text = self.innerText = ''
+
+	@property
+	def id(self) -> str | None:
+		return self.attrs.get('id')
+
+	@property
+	def firstElementChild(self) -> 'Element | None':
+		return self.children[0] if self.children else None
+
+	@property
+	def lastElementChild(self) -> 'Element | None':
+		return self.children[-1] if self.children else None
+
+	@property
+	def childElementCount(self) -> int:
+		return len(self.children)
+
+	@property
+	def innerHTML(self) -> str:
+		return ''
+
+	@innerHTML.setter
+	def innerHTML(self, value: str):
+		for c in self.children:
+			c.parentElement = None
+		self.children = []
+
+	def __le__(self, child: 'Element'):
+		'Brython: append child'
+		if child.parentElement:
+			child.remove()
+		child.parentElement = self
+		self.children.append(child)
+		return True
+
+	def remove(self):
+		if(p := self.parentElement):
+			p.children.remove(self)
+			self.parentElement = None
+
+	def is_connected(self) -> bool:
+		tag = self
+		while tag.parentElement:
+			tag = tag.parentElement
+		return tag is self.document.body
+
+	def count(self) -> int:
+		'Returns count of descendant elements'
+		return sum(1 + c.count() for c in self.children)
+
+	def getElementsByTagName(self, tag_name: str) -> NodeList:
+		'Returns descendant elements by tag name, "*" - all'
+		ret = NodeList()
+		for c in self.children:
+			if tag_name == '*' or c.tagName == tag_name:
+				ret.append(c)
+			ret.extend(c.getElementsByTagName(tag_name))
+		return ret
+
+	def setAttribute(self, name: str, value):
+		self.attrs[name] = value
+
+	def getAttribute(self, name: str) -> str | None:
+		return self.attrs.get(name)
+
+	def bind(self, event: str, callback):
+		pass
+
+	def createSVGTransform(self) -> Transform:
+		return Transform()
+
+	def createSVGPoint(self) -> Point:
+		return Point()
+
+
+class Document:
+
+	def __init__(self):
+		self.ids: dict[str, Element] = {}  # id: last element with id
+		self.handlers: dict[str, object] = {}  # event type: callback
+		self.body = Element(self, 'body')
+		for id in PAGE_TAGS:
+			self.body <= self.create_tag('div', id)
+		self.body <= (container := self.create_tag('div'))
+		container.classList.add(ROOT_TAG_CLASS)
+		container <= (svg := self.create_tag('svg', 'SvgContainer'))
+		svg <= self.create_tag('g', 'scheme')
+		svg <= self.create_tag('g', 'scheme_ui')
+
+	def create_tag(self, tag_name: str, id: str | None = None) -> Element:
+		ret = Element(self, tag_name)
+		if id:
+			ret.attrs['id'] = id
+		return ret
+
+	def createElementNS(self, ns: str, tag_name: str) -> Element:
+		return Element(self, tag_name)
+
+	def createElement(self, tag_name: str) -> Element:
+		return Element(self, tag_name)
+
+	def getElementById(self, id: str) -> Element | None:
+		if(ret := self.ids.get(id)) and ret.is_connected():
+			return ret
+		return None
+
+	def __getitem__(self, id: str) -> Element:
+		if not (ret := self.getElementById(id)):
+			raise KeyError(id)
+		return ret
+
+	def bind(self, event: str, callback):
+		self.handlers[event] = callback
+
+
+class Timer:
+	'Timers are not fired: replay is input only'
+
+	def __init__(self):
+		self.last_id = 0
+
+	def set_timeout(self, func, ms) -> int:
+		self.last_id += 1
+		return self.last_id
+
+	set_interval = set_timeout
+
+	def clear_timeout(self, id: int):
+		pass
+
+	clear_interval = clear_timeout
+
+
+class Worker:
+	'Background tasks are not run: replay is input only'
+
+	def __init__(self, worker_id: str):
+		pass
+
+	def bind(self, event: str, callback):
+		pass
+
+	def send(self, message):
+		pass
+
+
+def install_browser(document: Document) -> ModuleType:
+	'Installs stub browser module'
+	browser = ModuleType('browser')
+	browser.document = document
+	browser.html = SimpleNamespace()
+	browser.timer = Timer()
+	browser.worker = SimpleNamespace(Worker=Worker)
+	browser.window = SimpleNamespace(
+		document=document,
+		performance=SimpleNamespace(now=lambda: perf_counter() * 1000),
+		location=SimpleNamespace(search=''),
+		URLSearchParams=SimpleNamespace(new=lambda search: SimpleNamespace(get=lambda k: None)),
+	)
+	sys.modules['browser'] = browser
+	sys.modules['browser.timer'] = browser.timer
+	sys.modules['browser.worker'] = browser.worker
+	return browser
+
+
+def load_editor():
+	'Imports editor modules by Brython script ids'
+	for name in ('bs', 'po', 'odyssey_web_base', 'odyssey_test'):
+		sys.modules.pop(name, None)
+	if STATIC_PATH not in sys.path:
+		sys.path.insert(0, STATIC_PATH)
+	import odyssey_web_base
+	sys.modules['bs'] = odyssey_web_base
+	import odyssey_test
+	sys.modules['po'] = odyssey_test
+	return odyssey_test
+
+
+class Event(SimpleNamespace):
+
+	def preventDefault(self):
+		pass
+
+	def stopPropagation(self):
+		pass
+
+
+def replay(trace: dict, seed: int) -> dict:
+	'Replays trace with new editor. Returns report'
+	random.seed(seed)  # document objects IDs
+	document = Document()
+	install_browser(document)
+	po = load_editor()
+	po.OdysseyDrawExample.init()
+	odg = po.OdysseyDrawExample.get_odg()
+	odg.metrics = sys.modules['bs'].Metrics()  # commit timing
+	target = document['SvgContainer']
+	latency: dict[str, list[float]] = {}
+	for item in trace['events']:
+		ev = Event(target=target, **{k: v for k, v in item.items() if k != 't'})
+		if not (handler := document.handlers.get(ev.type)):
+			continue
+		start = perf_counter()
+		handler(ev)
+		latency.setdefault(ev.type, []).append((perf_counter() - start) * 1000)
+	commit = odg.metrics.histograms.get('commit')
+	return {
+		'latency': {k: get_latency_stats(v) for k, v in latency.items()},
+		'commit': {'count': sum(commit.counts) if commit else 0, 'sum_ms': round(commit.sum, 3) if commit else 0.},
+		'document': {
+			'objects': len(odg.document),
+			'vertices': sum(len(x.points) for x in odg.document),
+			'svg_elements': document['scheme_ui'].count(),
+			'text': odg.serialize(),
+		},
+	}
+
+
+def get_latency_stats(values: list[float]) -> dict:
+	'Returns latency statistics, ms'
+	values = sorted(values)
+	return {
+		'count': len(values),
+		'mean': round(mean(values), 4),
+		'p50': round(median(values), 4),
+		'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 4),
+		'max': round(values[-1], 4),
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Replays editor input trace with handlers latency measurement')
+	parser.add_argument('trace', help='trace file recorded by editor')
+	parser.add_argument('--repeat', type=int, default=1, help='replay count, report of the best run is shown')
+	parser.add_argument('--seed', type=int, default=0, help='random seed of document objects IDs')
+	parser.add_argument('--json', action='store_true', help='print report as JSON')
+	args = parser.parse_args()
+	with open(args.trace) as f:
+		trace = json.load(f)
+	reports = [replay(trace, args.seed) for _ in range(max(1, args.repeat))]
+	report = min(reports, key=lambda x: sum(v['mean'] * v['count'] for v in x['latency'].values()))
+	if args.json:
+		print(json.dumps(report, indent='\t'))
+		return
+	print(f'{"event":<12} {"count":>7} {"mean":>9} {"p50":>9} {"p95":>9} {"max":>9}  ms')
+	for k, v in report['latency'].items():
+		print(f'{k:<12} {v["count"]:>7} {v["mean"]:>9.4f} {v["p50"]:>9.4f} {v["p95"]:>9.4f} {v["max"]:>9.4f}')
+	print(f'commits: {report["commit"]["count"]}, {report["commit"]["sum_ms"]} ms')
+	doc = report['document']
+	print(f'document: {doc["objects"]} objects, {doc["vertices"]} vertices, {doc["svg_elements"]} SVG elements')
+	print(doc['text'], end='')
+
+
+if __name__ == '__main__':
+	main()